@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+
+import numpy as np
+
+from trace_io import chunks, load_captures, read_chunk
+
+
+def find_shifts(traces, reference, window=slice(None), max_shift=None):
+    """Shift of every trace against the reference.
+
+    The cross-correlation of the window of all traces with the same window
+    of the reference is computed at once with real FFTs (zero padded, so
+    it is not circular) and the lag of its peak is the shift.
+
+    Args:
+        traces: Batch of traces [trace, sample].
+        reference: Reference trace [sample].
+        window: Slice of the samples to align on.
+        max_shift: Largest shift considered in both directions.
+
+    Returns:
+        Shift per trace, positive if the trace is late.
+    """
+    segments = traces[:, window] - np.mean(traces[:, window], axis=1,
+                                           keepdims=True)
+    reference = reference[window] - np.mean(reference[window])
+
+    length = np.shape(segments)[1]
+    size = 2 * length
+    correlations = np.fft.irfft(np.fft.rfft(segments, size) *
+                                np.conj(np.fft.rfft(reference, size)), size)
+
+    # lags 0..max_shift are at the start, negative lags at the end
+    max_shift = length - 1 if max_shift is None else min(max_shift, length - 1)
+    lags = np.concatenate([np.arange(max_shift + 1),
+                           np.arange(-max_shift, 0)])
+    correlations = correlations[:, lags]
+    return lags[np.argmax(correlations, axis=1)]
+
+
+def apply_shifts(traces, shifts):
+    """Shift every trace back by its shift, repeating the edge samples."""
+    num_points = np.shape(traces)[1]
+    indices = np.clip(np.arange(num_points) + shifts[:, np.newaxis], 0,
+                      num_points - 1)
+    return np.take_along_axis(traces, indices, axis=1)
+
+
+def align(trace_array, reference, output, window=slice(None), max_shift=None,
+          chunk_size=1000):
+    """Align all traces in batches and write them into `output`.
+
+    Returns:
+        Shift of every trace.
+    """
+    num_traces = np.shape(trace_array)[0]
+    shifts = np.empty(num_traces, dtype=np.int64)
+    for traces in chunks(num_traces, chunk_size):
+        batch = read_chunk(trace_array, traces, dtype=trace_array.dtype)
+        shifts[traces] = find_shifts(batch, reference, window, max_shift)
+        output[traces] = apply_shifts(batch, shifts[traces])
+    return shifts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Align the captured traces to a reference trace")
+    parser.add_argument('--captures',
+                        default='./captures/',
+                        help="directory with the captured .npy arrays")
+    parser.add_argument('--output',
+                        default='./aligned/',
+                        help="directory for the aligned .npy arrays")
+    parser.add_argument('--window',
+                        type=int,
+                        nargs=2,
+                        metavar=('START', 'STOP'),
+                        help="samples to align on (default: all)")
+    parser.add_argument('--max-shift',
+                        type=int,
+                        help="largest shift in samples (default: any)")
+    parser.add_argument('--reference',
+                        type=int,
+                        default=0,
+                        help="index of the reference trace")
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=1000,
+                        help="number of traces aligned at once")
+    args = parser.parse_args()
+
+    trace_array, textin_array, known_keys = load_captures(args.captures)
+    window = slice(*args.window) if args.window else slice(None)
+    reference = np.array(trace_array[args.reference])
+
+    os.makedirs(args.output, exist_ok=True)
+    aligned = np.lib.format.open_memmap(os.path.join(args.output,
+                                                     'trace_array.npy'),
+                                        mode='w+',
+                                        dtype=trace_array.dtype,
+                                        shape=np.shape(trace_array))
+    shifts = align(trace_array, reference, aligned, window, args.max_shift,
+                   args.chunk_size)
+    aligned.flush()
+
+    # saved from the loaded arrays, the captures may be a trace archive
+    np.save(os.path.join(args.output, 'textin_array.npy'), textin_array)
+    np.save(os.path.join(args.output, 'known_keys.npy'), known_keys)
+
+    print("INFO: Aligned {} traces, shifts between {} and {}".format(
+        len(shifts), np.min(shifts), np.max(shifts)))
@@ -4,10 +4,10 @@ from tqdm.notebook import tnrange
 import numpy as np
 import matplotlib.pylab as plt
 
-# Load Captured Traces from Disk
-trace_array = np.load('trace_array.npy')
-textin_array = np.load('textin_array.npy')
-known_keys = np.load('known_keys.npy')
+# Load Captured Traces from Disk (memory mapped, read on access)
+trace_array = np.load('trace_array.npy', mmap_mode='r')
+textin_array = np.load('textin_array.npy', mmap_mode='r')
+known_keys = np.load('known_keys.npy', mmap_mode='r')
 
 numtraces = np.shape(trace_array)[0] #total number of traces
 numpoints = np.shape(trace_array)[1] #samples per trace
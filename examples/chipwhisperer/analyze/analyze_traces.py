@@ -1,28 +1,25 @@
 #!/usr/bin/python3
 
+import argparse
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from multiprocessing.shared_memory import SharedMemory
+
 from tqdm.notebook import tnrange
 import numpy as np
 
-trace_array = np.load('./captures/' +
-                      'trace_array.npy')
-# '500_traces/trace_array.npy')
-# '2500_traces/trace_array.npy')
-
-textin_array = np.load('./captures/' +
-                       'textin_array.npy')
-# '500_traces/textin_array.npy')
-# '2500_traces/textin_array.npy')
-
-known_keys = np.load('./captures/' +
-                     'known_keys.npy')
-# '500_traces/known_keys.npy')
-# '2500_traces/known_keys.npy')
-
-num_traces = np.shape(trace_array)[0]  # total number of traces
-num_points = np.shape(trace_array)[1]  # samples per trace
-known_key = known_keys[0]
+from attack_result import AttackResult
+from hypothesis_cache import load_intermediate_table
+from result_cache import ResultCache, capture_fingerprint
+from timing import Timings, profiled
+from trace_io import chunks, load_captures, load_poi_map, read_chunk
 
 num_subkeys = 16
+num_guesses = 256
 
 sbox = (0x63, 0x7c, 0x77, 0x7b, 0xf2, 0x6b, 0x6f, 0xc5, 0x30, 0x01, 0x67, 0x2b,
         0xfe, 0xd7, 0xab, 0x76, 0xca, 0x82, 0xc9, 0x7d, 0xfa, 0x59, 0x47, 0xf0,
@@ -47,72 +44,509 @@ sbox = (0x63, 0x7c, 0x77, 0x7b, 0xf2, 0x6b, 0x6f, 0xc5, 0x30, 0x01, 0x67, 0x2b,
         0x8c, 0xa1, 0x89, 0x0d, 0xbf, 0xe6, 0x42, 0x68, 0x41, 0x99, 0x2d, 0x0f,
         0xb0, 0x54, 0xbb, 0x16)
 
+# SBox as lookup table to build the hypotheses for all traces at once
+sbox_table = np.asarray(sbox, dtype=np.uint8)
+
+
+# number of set bits for every byte value
+hamming_weight = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis],
+                               axis=1).sum(axis=1).astype(np.uint8)
+
 
 def intermediate(pt, keyguess):
     return sbox[pt ^ keyguess]
 
 
-# Calculate the difference of means and pick the right guess
+# inverse SBox to get back the SBox input state of an intermediate value
+inv_sbox_table = np.argsort(sbox_table).astype(np.uint8)
 
-key_guesses = np.empty([num_subkeys])
+# Leakage models map the intermediate values (SBox outputs) of every trace
+# and guess to the hypothetical leakage of the first round.
 
-mean_diffs = np.zeros(255)
-global_mean_diffs = np.empty([num_subkeys, 255])
-global_mean_diffs_hex = np.chararray([num_subkeys, 255],
-                                     itemsize=4,
-                                     unicode=True)
+def hw_model(values):
+    """Hamming weight of the SBox output."""
+    return hamming_weight[values]
 
-plots = np.empty([255, num_points])
-global_plots = np.empty([num_subkeys, num_points])
-color_mask = np.empty([num_subkeys, 255])
 
-# separating traces into different groups based on the SBox's output
-# based on the least significant bit (but really any bit would work)
-for subkey in tnrange(0, num_subkeys, desc="Attacking Subkey"):
-    for kguess in tnrange(255, desc="Keyguess", leave=False):
-        one_list = []
-        zero_list = []
+def hd_model(values):
+    """Hamming distance between the state before and after the SBox."""
+    return hamming_weight[values ^ inv_sbox_table[values]]
 
-        for tnum in range(num_traces):
-            if (intermediate(textin_array[tnum][subkey], kguess) & 1):
-                # LSB is 1
-                one_list.append(trace_array[tnum])
-            else:
-                zero_list.append(trace_array[tnum])
+
+def bit_model(values, bit=0):
+    """Single bit of the SBox output (LSB by default)."""
+    return (values >> bit) & 1
+
+
+leakage_models = {
+    'hw': hw_model,
+    'hd': hd_model,
+    'bit': bit_model,
+}
+
+
+def intermediates(textin_array, subkey, num_guesses=num_guesses):
+    """SBox outputs [trace, guess] of one subkey.
+
+    Instead of the plaintexts, a precomputed table [trace, subkey, guess]
+    from `hypothesis_cache` can be passed.
+    """
+    if np.ndim(textin_array) == 3:
+        return textin_array[:, subkey, :num_guesses]
+    guesses = np.arange(num_guesses, dtype=np.uint8)
+    return sbox_table[textin_array[:, subkey, np.newaxis] ^ guesses]
+
+
+def hypotheses(textin_array, subkey, model, num_guesses=num_guesses):
+    """Hypothesis matrix [trace, guess] of `model` for one subkey."""
+    return model(intermediates(textin_array, subkey, num_guesses))
+
+
+def difference_of_means(trace_array, textin_array, subkey,
+                        num_guesses=num_guesses, chunk_size=None,
+                        window_size=None, dtype=np.float64):
+    """Difference of means of all key guesses for one subkey.
+
+    The traces are separated into two groups based on the least significant
+    bit of the SBox output (but really any bit would work). Instead of
+    looping over guesses and traces, the hypothesis matrix [trace, guess] is
+    gathered from `sbox_table` and the group sums are computed with a single
+    matrix product.
+
+    Args:
+        trace_array: Captured traces [trace, sample], may be memory mapped.
+        textin_array: Plaintexts [trace, byte].
+        subkey: Index of the attacked key byte.
+        num_guesses: Number of key guesses, starting at 0.
+        chunk_size: Number of traces read at once (all if None).
+        window_size: Number of samples processed at once (all if None).
+        dtype: Type the traces are processed in, e.g. float32 to halve the
+            memory traffic. The sums are always accumulated in float64.
+
+    Returns:
+        mean_diffs: Maximum difference of means per guess [guess].
+        plots: Absolute difference of means per guess [guess, sample].
+    """
+    num_traces, num_points = np.shape(trace_array)
+    plots = np.empty([num_guesses, num_points], dtype=dtype)
+
+    for window in chunks(num_points, window_size):
+        window_points = len(range(num_points)[window])
+        num_ones = np.zeros([num_guesses, 1])
+        one_sums = np.zeros([num_guesses, window_points])
+        trace_sums = np.zeros(window_points)
+        for traces in chunks(num_traces, chunk_size):
+            ones = hypotheses(textin_array[traces], subkey, bit_model,
+                              num_guesses).astype(dtype)
+            chunk = read_chunk(trace_array, traces, window, dtype)
+
+            num_ones += np.sum(ones, axis=0, dtype=np.float64)[:, np.newaxis]
+            one_sums += ones.T @ chunk
+            trace_sums += np.sum(chunk, axis=0, dtype=np.float64)
+        zero_sums = trace_sums - one_sums
 
         # calculate the difference of means
-        one_avg = np.asarray(one_list).mean(axis=0)
-        zero_avg = np.asarray(zero_list).mean(axis=0)
-        mean_diffs[kguess] = np.max(abs(one_avg - zero_avg))
-        plots[kguess] = abs(one_avg - zero_avg)
-
-    # collect data for every subkey
-    global_plots[subkey] = plots[mean_diffs.argsort()][-1]
-    global_mean_diffs[subkey] = np.flip(np.sort(mean_diffs))
-    mean_diffs_hex = [hex(i) for i in np.flip(np.argsort(mean_diffs))]
-    # global_mean_diffs[subkey] = np.flip(np.sort(mean_diffs))[:255]
-    # mean_diffs_hex = [hex(i) for i in np.flip(np.argsort(mean_diffs))[:255]]
-    global_mean_diffs_hex[subkey] = mean_diffs_hex
-
-    # create mask for box plot
-    color_mask[subkey] = [
-        1 if hex_value == hex(known_key[subkey]) else 0
-        for hex_value in mean_diffs_hex
-    ]
-
-    # repeat with each possible key guess
-    # then pick the one with the highest difference of means
-    guess = np.argsort(mean_diffs)[-1]
-    key_guesses[subkey] = guess
-    print(hex(guess) + "(real = 0x{:02x})".format(known_key[subkey]))
-
-print(len(global_plots))
-print(global_mean_diffs)
-print(global_mean_diffs_hex)
-
-# save results
-np.save('./results/global_plots.npy', global_plots)
-np.save('./results/global_mean_diffs.npy', global_mean_diffs)
-np.save('./results/global_mean_diffs_hex.npy', global_mean_diffs_hex)
-np.save('./results/key_guesses.npy', key_guesses)
-np.save('./results/color_mask.npy', color_mask)
+        one_avg = one_sums / num_ones
+        zero_avg = zero_sums / (num_traces - num_ones)
+        plots[:, window] = abs(one_avg - zero_avg)
+
+    return np.max(plots, axis=1), plots
+
+
+def correlation(trace_array, textin_array, subkey, model=hw_model,
+                num_guesses=num_guesses, chunk_size=None, window_size=None,
+                dtype=np.float64):
+    """Correlation power analysis of all key guesses for one subkey.
+
+    The Pearson correlation between the hypotheses of `model` and every
+    sample is computed for all guesses in one matrix product per chunk.
+
+    Args:
+        trace_array: Captured traces [trace, sample], may be memory mapped.
+        textin_array: Plaintexts [trace, byte].
+        subkey: Index of the attacked key byte.
+        model: Leakage model, see `leakage_models`.
+        num_guesses: Number of key guesses, starting at 0.
+        chunk_size: Number of traces read at once (all if None).
+        window_size: Number of samples processed at once (all if None).
+        dtype: Type the traces are processed in, see `difference_of_means`.
+
+    Returns:
+        max_corrs: Maximum absolute correlation per guess [guess].
+        plots: Absolute correlation per guess [guess, sample].
+    """
+    num_traces, num_points = np.shape(trace_array)
+    plots = np.empty([num_guesses, num_points], dtype=dtype)
+
+    hyp_sums = 0
+    hyp_squares = 0
+    for traces in chunks(num_traces, chunk_size):
+        hyps = hypotheses(textin_array[traces], subkey, model,
+                          num_guesses).astype(np.float64)
+        hyp_sums += np.sum(hyps, axis=0)
+        hyp_squares += np.sum(hyps * hyps, axis=0)
+    hyp_means = hyp_sums / num_traces
+    hyp_norms = np.sqrt(hyp_squares - hyp_sums * hyp_means)
+
+    for window in chunks(num_points, window_size):
+        window_points = len(range(num_points)[window])
+        trace_means = np.zeros(window_points)
+        for traces in chunks(num_traces, chunk_size):
+            trace_means += np.sum(read_chunk(trace_array, traces, window,
+                                             dtype),
+                                  axis=0,
+                                  dtype=np.float64)
+        trace_means = (trace_means / num_traces).astype(dtype)
+
+        covariances = np.zeros([num_guesses, window_points])
+        trace_norms = np.zeros(window_points)
+        for traces in chunks(num_traces, chunk_size):
+            hyps = (hypotheses(textin_array[traces], subkey, model,
+                               num_guesses) - hyp_means).astype(dtype)
+            centered = read_chunk(trace_array, traces, window,
+                                  dtype) - trace_means
+            covariances += hyps.T @ centered
+            trace_norms += np.sum(centered * centered,
+                                  axis=0,
+                                  dtype=np.float64)
+
+        deviations = np.outer(hyp_norms, np.sqrt(trace_norms))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            plots[:, window] = abs(np.nan_to_num(covariances / deviations))
+
+    return np.max(plots, axis=1), plots
+
+
+def collect_results(subkey_scores, known_key, num_points,
+                    num_subkeys=num_subkeys):
+    """Collect the per-subkey scores into an `AttackResult`.
+
+    Args:
+        subkey_scores: Iterable of (scores [guess], plots [guess, sample])
+            for every subkey, e.g. as returned by `difference_of_means`.
+        known_key: The real key to rank and mark in the color mask.
+        num_points: Samples per trace.
+
+    Returns:
+        The `AttackResult` as stored in `./results/attack_result.npz`.
+    """
+    result = AttackResult.empty(num_subkeys, num_guesses, num_points,
+                                known_key)
+
+    for subkey, (scores, plots) in enumerate(subkey_scores):
+        result.set(subkey, scores, plots)
+
+        # the guess with the highest score
+        guess = np.argmin(result.ranks[subkey])
+        print(hex(guess) + "(real = 0x{:02x})".format(known_key[subkey]))
+
+    return result
+
+
+def attack(trace_array, textin_array, known_key, num_subkeys=num_subkeys,
+           score=difference_of_means):
+    """Run an attack on every subkey.
+
+    Args:
+        score: Function returning the score per guess and the per-sample
+            curves for one subkey, e.g. `difference_of_means` or
+            `correlation`.
+
+    Returns:
+        The `AttackResult`, see `collect_results`.
+    """
+    num_points = np.shape(trace_array)[1]  # samples per trace
+
+    return collect_results(
+        (score(trace_array, textin_array, subkey)
+         for subkey in tnrange(0, num_subkeys, desc="Attacking Subkey")),
+        known_key, num_points, num_subkeys)
+
+
+# arrays shared with the worker processes of `parallel_attack`
+_shared_arrays = {}
+
+# thread pools of the BLAS libraries numpy may use, read when numpy loads
+blas_thread_variables = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                         'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS')
+
+
+@contextmanager
+def single_threaded_blas():
+    """Processes started in this context run BLAS on a single thread.
+
+    The variables only take effect in a fresh interpreter, so the workers
+    have to be spawned (not forked from the already loaded numpy).
+    """
+    saved = {name: os.environ.get(name) for name in blas_thread_variables}
+    os.environ.update(dict.fromkeys(blas_thread_variables, '1'))
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+
+def _share(array):
+    """Describe `array` so a worker can attach to it without a copy.
+
+    Memory mapped arrays are reopened from their file (the page cache is
+    shared), everything else is copied once into shared memory.
+
+    Returns:
+        The description and the SharedMemory block (or None) to release.
+    """
+    if isinstance(array, np.memmap):
+        return ('memmap', array.filename, array.offset, array.shape,
+                array.dtype.str), None
+
+    array = np.asarray(array)
+    shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return ('shm', shm.name, 0, array.shape, array.dtype.str), shm
+
+
+def _attach(descriptions):
+    """Worker initializer: open the shared arrays by name."""
+    for name, (kind, location, offset, shape, dtype) in descriptions.items():
+        if kind == 'memmap':
+            array = np.memmap(location, dtype=dtype, mode='r', offset=offset,
+                              shape=shape)
+            _shared_arrays[name] = (array, None)
+        else:
+            shm = SharedMemory(name=location)
+            array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            _shared_arrays[name] = (array, shm)  # keep the block alive
+
+
+def _score_tile(score, subkey, window):
+    """Worker task: curves of one subkey on one sample window."""
+    trace_array = _shared_arrays['trace_array'][0]
+    textin_array = _shared_arrays['textin_array'][0]
+    return score(trace_array[:, window], textin_array, subkey)[1]
+
+
+def parallel_attack(trace_array, textin_array, known_key, jobs,
+                    num_subkeys=num_subkeys, score=difference_of_means,
+                    window_size=None):
+    """Run the subkey attacks of `attack` on a pool of processes.
+
+    The workers share the trace matrix without copying it. Every task
+    covers one subkey, or one subkey and sample window if `window_size` is
+    given, and the curves are gathered into the same `AttackResult`. The
+    workers run BLAS on one thread each, so `jobs` workers do not
+    oversubscribe `jobs` cores.
+
+    Args:
+        jobs: Number of worker processes.
+        window_size: Number of samples per task (all if None).
+
+    Returns:
+        The `AttackResult`, see `collect_results`.
+    """
+    num_points = np.shape(trace_array)[1]  # samples per trace
+    windows = chunks(num_points, window_size)
+
+    def gather(tasks):
+        for subkey in tnrange(0, num_subkeys, desc="Attacking Subkey"):
+            curves = np.empty([num_guesses, num_points])
+            for window, task in zip(windows, tasks[subkey]):
+                curves[:, window] = task.result()
+            yield np.max(curves, axis=1), curves
+
+    descriptions = {}
+    blocks = []
+    try:
+        for name, array in (('trace_array', trace_array),
+                            ('textin_array', textin_array)):
+            descriptions[name], shm = _share(array)
+            if shm is not None:
+                blocks.append(shm)
+
+        with single_threaded_blas(), ProcessPoolExecutor(
+                max_workers=jobs,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_attach,
+                initargs=(descriptions,)) as executor:
+            tasks = [[executor.submit(_score_tile, score, subkey, window)
+                      for window in windows]
+                     for subkey in range(num_subkeys)]
+            return collect_results(gather(tasks), known_key, num_points,
+                                   num_subkeys)
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Attack the captured traces")
+    parser.add_argument('--captures',
+                        default='./captures/',
+                        help="directory with the captured (or reduced, see "
+                        "select_poi.py) .npy arrays")
+    parser.add_argument('--mode',
+                        choices=['dom', 'cpa', 'cpa2'],
+                        default='dom',
+                        help="difference of means, correlation or "
+                        "second-order correlation attack")
+    parser.add_argument('--model',
+                        choices=sorted(leakage_models),
+                        default='hw',
+                        help="leakage model of the cpa mode")
+    parser.add_argument('--bit',
+                        type=int,
+                        default=0,
+                        help="SBox output bit of the 'bit' leakage model")
+    parser.add_argument('--combine',
+                        choices=['product', 'absdiff'],
+                        default='product',
+                        help="combining of the sample pairs in cpa2 mode: "
+                        "centered product or absolute difference")
+    parser.add_argument('--pair-window',
+                        type=int,
+                        nargs=2,
+                        metavar=('START', 'STOP'),
+                        help="samples whose pairs are combined in cpa2 mode "
+                        "(default: all)")
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        help="number of traces read at once (default: all)")
+    parser.add_argument('--window-size',
+                        type=int,
+                        help="number of samples processed at once "
+                        "(default: all, cpa2: 32 x 32 sample pair tiles)")
+    parser.add_argument('--dtype',
+                        choices=['float64', 'float32'],
+                        default='float64',
+                        help="type the traces are processed in, float32 "
+                        "halves the memory traffic (sums stay float64)")
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=1,
+                        help="number of worker processes, each attacking "
+                        "one subkey (or subkey and sample window)")
+    parser.add_argument('--hypothesis-cache',
+                        default='./cache/',
+                        help="directory caching the SBox outputs per "
+                        "plaintext set (empty to disable)")
+    parser.add_argument('--hypothesis-cache-size',
+                        type=int,
+                        default=512,
+                        help="size limit of the SBox output cache in MB")
+    parser.add_argument('--result-cache',
+                        default='./cache/results/',
+                        help="directory caching the results per capture "
+                        "and attack parameters (empty to disable)")
+    parser.add_argument('--result-cache-size',
+                        type=int,
+                        default=512,
+                        help="size limit of the result cache in MB")
+    parser.add_argument('--timing-report',
+                        default='./results/timing_analyze.json',
+                        help="JSON file with the time and throughput of "
+                        "each stage (empty to disable)")
+    parser.add_argument('--profile',
+                        help="dump a cProfile of the attack to this file "
+                        "(view with snakeviz or pstats)")
+    args = parser.parse_args()
+
+    timings = Timings('analyze')
+
+    result_files = ['attack_result.npz']
+
+    # skip the attack if the same captures were already attacked the same way
+    if args.result_cache:
+        result_cache = ResultCache(args.result_cache,
+                                   args.result_cache_size * 2**20)
+        fingerprint = capture_fingerprint(args.captures, {
+            'mode': args.mode,
+            'model': args.model,
+            'bit': args.bit,
+            'combine': args.combine,
+            'pair_window': args.pair_window,
+            'dtype': args.dtype,
+        })
+        with timings.stage('result_cache'):
+            cached = result_cache.get(fingerprint, './results/', result_files)
+        if cached:
+            print("INFO: Captures unchanged, reusing the cached results")
+            timings.count('result_cache_hits')
+            if args.timing_report:
+                timings.save(args.timing_report)
+            sys.exit(0)
+
+    model = leakage_models[args.model]
+    if args.model == 'bit':
+        model = partial(bit_model, bit=args.bit)
+    if args.mode == 'cpa':
+        score = partial(correlation, model=model)
+    else:
+        score = difference_of_means
+    score = partial(score, chunk_size=args.chunk_size, dtype=args.dtype)
+
+    # memory mapped, the attacks only read one chunk at a time
+    with timings.stage('load'):
+        trace_array, textin_array, known_keys = load_captures(args.captures)
+        # './captures/500_traces/'
+        # './captures/2500_traces/'
+
+        known_key = known_keys[0]
+
+        if args.hypothesis_cache:
+            textin_array = load_intermediate_table(
+                textin_array, args.hypothesis_cache,
+                args.hypothesis_cache_size * 2**20)
+
+    num_traces, num_points = np.shape(trace_array)
+    with timings.stage('attack',
+                       traces=num_traces,
+                       nbytes=num_traces * num_points *
+                       np.dtype(trace_array.dtype).itemsize), \
+            profiled(args.profile):
+        if args.mode == 'cpa2':
+            from second_order import second_order_scores
+
+            pair_window = (slice(*args.pair_window)
+                           if args.pair_window else slice(None))
+            subkey_scores = second_order_scores(
+                trace_array,
+                textin_array,
+                pair_window,
+                model,
+                args.combine,
+                block_size=args.window_size or 32,
+                chunk_size=args.chunk_size)
+            result = collect_results(subkey_scores, known_key, num_points)
+        elif args.jobs > 1:
+            # the sample windows become the tiles of the workers
+            result = parallel_attack(trace_array, textin_array, known_key,
+                                     args.jobs,
+                                     score=score,
+                                     window_size=args.window_size)
+        else:
+            result = attack(trace_array, textin_array, known_key,
+                            score=partial(score,
+                                          window_size=args.window_size))
+
+    # place the curves of reduced traces back at the original samples
+    poi_map = load_poi_map(args.captures)
+    if poi_map is not None:
+        result.expand(poi_map)
+
+    print("Key ranks:", result.known_ranks)
+    print(result.sorted_scores[:, :5])
+
+    # save results
+    with timings.stage('save'):
+        result.save('./results/attack_result.npz')
+
+        if args.result_cache:
+            result_cache.put(fingerprint, './results/', result_files)
+
+    timings.print()
+    if args.timing_report:
+        timings.save(args.timing_report)
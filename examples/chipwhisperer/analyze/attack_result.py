@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+from trace_io import expand_samples
+
+# label of every key byte value, only looked up when a table needs them
+_hex_labels = np.array([hex(guess) for guess in range(256)])
+
+
+class AttackResult:
+    """Scores and curves of every subkey and key guess.
+
+    The stored arrays are indexed by the guess value (not by its rank):
+
+        scores     [subkey, guess]          score of the attack
+        peaks      [subkey, guess]          sample with the highest curve
+        ranks      [subkey, guess]          1 for the best guess, tied
+                                            guesses share the worst rank
+        curves     [subkey, guess, sample]  float32
+        known_key  [subkey]
+
+    The sorted scores, hex labels, color mask and best curves shown in the
+    reports are derived from them on demand. The whole result is saved as
+    a single .npz file.
+    """
+
+    def __init__(self, scores, peaks, ranks, curves, known_key):
+        self.scores = scores
+        self.peaks = peaks
+        self.ranks = ranks
+        self.curves = curves
+        self.known_key = known_key
+
+    @classmethod
+    def empty(cls, num_subkeys, num_guesses, num_points, known_key=None):
+        """Preallocate the result, the subkeys are filled in with `set`."""
+        if known_key is None:
+            known_key = np.zeros(num_subkeys, dtype=np.uint8)
+        return cls(
+            np.zeros([num_subkeys, num_guesses]),
+            np.zeros([num_subkeys, num_guesses], dtype=np.int64),
+            np.zeros([num_subkeys, num_guesses], dtype=np.int16),
+            np.empty([num_subkeys, num_guesses, num_points], dtype=np.float32),
+            np.asarray(known_key[:num_subkeys], dtype=np.uint8))
+
+    @classmethod
+    def load(cls, path='./results/attack_result.npz'):
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+    def save(self, path='./results/attack_result.npz', compressed=False):
+        """Write the result, `compressed` trades save time for file size."""
+        savez = np.savez_compressed if compressed else np.savez
+        savez(path,
+              scores=self.scores,
+              peaks=self.peaks,
+              ranks=self.ranks,
+              curves=self.curves,
+              known_key=self.known_key)
+
+    def set(self, subkey, scores, curves):
+        """Store the scores [guess] and curves [guess, sample] of a subkey."""
+        self.scores[subkey] = scores
+        self.curves[subkey] = curves
+        self.peaks[subkey] = np.argmax(curves, axis=1)
+        # number of guesses scoring at least as high, so ties count against
+        # a guess like in `CPAAccumulator.key_ranks`
+        self.ranks[subkey] = len(scores) - np.searchsorted(np.sort(scores),
+                                                           scores)
+
+    def expand(self, poi_map):
+        """Move the curves of a reduced capture back to the original samples."""
+        self.peaks = poi_map[0][self.peaks]
+        self.curves = expand_samples(self.curves, poi_map)
+
+    @property
+    def order(self):
+        """Guesses of every subkey from best to worst [subkey, rank]."""
+        return np.argsort(self.ranks, axis=1, kind='stable')
+
+    @property
+    def key_guesses(self):
+        """Best guess of every subkey."""
+        return self.order[:, 0]
+
+    @property
+    def known_ranks(self):
+        """Rank of the known key byte of every subkey."""
+        return self.ranks[np.arange(len(self.ranks)), self.known_key]
+
+    @property
+    def sorted_scores(self):
+        """Scores from best to worst [subkey, rank]."""
+        return np.take_along_axis(self.scores, self.order, axis=1)
+
+    @property
+    def color_mask(self):
+        """True where the sorted guesses are the known key [subkey, rank]."""
+        return self.order == self.known_key[:, np.newaxis]
+
+    @property
+    def best_curves(self):
+        """Curve of the best guess of every subkey [subkey, sample]."""
+        return self.curves[np.arange(len(self.curves)), self.key_guesses]
+
+    def hex_labels(self, num_rows=None):
+        """Hex strings of the sorted guesses [subkey, rank] for a table."""
+        return _hex_labels[self.order[:, :num_rows]]
@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+from functools import partial
+
+import numpy as np
+
+from analyze_traces import (attack, correlation, difference_of_means,
+                            parallel_attack)
+from cpa_accumulator import CPAAccumulator
+from timing import Timings
+from trace_io import chunks, load_captures
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                    'capture'))
+from simulation import default_key, simulate_traces  # noqa: E402
+
+chunk_size = 500
+
+
+def streaming_attack(trace_array, textin_array, known_key):
+    accumulator = CPAAccumulator(np.shape(trace_array)[1])
+    for traces in chunks(np.shape(trace_array)[0], chunk_size):
+        accumulator.update(trace_array[traces], textin_array[traces])
+    return accumulator.key_guesses()
+
+
+# Every implementation returns its best guess per subkey, which is checked
+# against the known key
+implementations = {
+    'dom':
+    lambda traces, texts, key: attack(traces, texts, key).key_guesses,
+    'dom-chunked':
+    lambda traces, texts, key: attack(
+        traces, texts, key,
+        score=partial(difference_of_means, chunk_size=chunk_size)).key_guesses,
+    'cpa':
+    lambda traces, texts, key: attack(traces, texts, key,
+                                      score=correlation).key_guesses,
+    'cpa-float32':
+    lambda traces, texts, key: attack(
+        traces, texts, key, score=partial(correlation,
+                                          dtype=np.float32)).key_guesses,
+    'cpa-parallel':
+    lambda traces, texts, key: parallel_attack(
+        traces, texts, key, os.cpu_count(), score=correlation).key_guesses,
+    'cpa-streaming':
+    streaming_attack,
+}
+
+
+def synthetic_captures(directory, num_traces, num_points, seed=0):
+    """Simulated captures in the layout of capture.py (generated once)."""
+    directory = os.path.join(directory,
+                             '{}x{}'.format(num_traces, num_points))
+    if os.path.exists(os.path.join(directory, 'known_keys.npy')):
+        return directory
+
+    rng = np.random.default_rng(seed)
+    textin_array = rng.integers(0, 256, (num_traces, 16), dtype=np.uint8)
+    trace_array = simulate_traces(textin_array, default_key, num_points,
+                                  rng=rng)
+    known_keys = np.tile(np.frombuffer(bytes(default_key), dtype=np.uint8),
+                         (num_traces, 1))
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'trace_array.npy'), trace_array)
+    np.save(os.path.join(directory, 'textin_array.npy'), textin_array)
+    # written last, marks the captures as complete
+    np.save(os.path.join(directory, 'known_keys.npy'), known_keys)
+    return directory
+
+
+def _run_case(implementation, directory, connection):
+    trace_array, textin_array, known_keys = load_captures(directory)
+    num_traces, num_points = np.shape(trace_array)
+
+    timings = Timings(implementation)
+    with timings.stage('attack',
+                       traces=num_traces,
+                       nbytes=num_traces * num_points *
+                       np.dtype(trace_array.dtype).itemsize):
+        key_guesses = implementations[implementation](trace_array,
+                                                      textin_array,
+                                                      known_keys[0])
+
+    stage = timings.report()['stages']['attack']
+    connection.send({
+        'seconds': stage['seconds'],
+        'traces_per_second': stage['traces_per_second'],
+        'mb_per_second': stage['mb_per_second'],
+        # kilobytes on Linux
+        'peak_rss_mb':
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        # the largest worker process (0 without workers), the workers of
+        # cpa-parallel have ended once the attack returns
+        'peak_worker_rss_mb':
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        'key_recovered':
+        bool(np.all(key_guesses == known_keys[0])),
+    })
+    connection.close()
+
+
+def run_case(implementation, directory):
+    """Run one implementation in a fresh process, so the peak RSS is its own."""
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_case,
+                              args=(implementation, directory, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        raise RuntimeError("{} failed on {}".format(implementation,
+                                                    directory)) from None
+    finally:
+        process.join()
+    return result
+
+
+def compare(results, baseline, max_slowdown, max_memory_increase):
+    """Regressions of the results against a previous benchmark.
+
+    Returns:
+        One message per case slower or larger than allowed.
+
+    Raises:
+        ValueError: If the baseline ran on a different number of CPUs,
+            which changes the parallel cases.
+    """
+    if baseline.get('cpu_count') != os.cpu_count():
+        raise ValueError(
+            "The baseline ran on {} CPUs and this benchmark on {}".format(
+                baseline.get('cpu_count'), os.cpu_count()))
+
+    previous = {
+        (case['implementation'], case['traces'], case['samples']): case
+        for case in baseline['cases']
+    }
+    regressions = []
+    for case in results:
+        key = (case['implementation'], case['traces'], case['samples'])
+        if key not in previous:
+            continue
+        for field, limit in (('seconds', max_slowdown),
+                             ('peak_rss_mb', max_memory_increase),
+                             ('peak_worker_rss_mb', max_memory_increase)):
+            if not case.get(field) or not previous[key].get(field):
+                continue  # no workers, or a baseline without the field
+            change = case[field] / previous[key][field] - 1
+            case.setdefault('change', {})[field] = change
+            if limit is not None and change > limit:
+                regressions.append("{} {}x{}: {} {:+.0%}".format(
+                    *key, field, change))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the attacks on synthetic captures")
+    parser.add_argument('--traces',
+                        type=int,
+                        nargs='+',
+                        default=[250, 500, 2500, 10000],
+                        help="numbers of traces")
+    parser.add_argument('--samples',
+                        type=int,
+                        nargs='+',
+                        default=[1500, 5000],
+                        help="numbers of samples per trace")
+    parser.add_argument('--implementations',
+                        nargs='+',
+                        choices=sorted(implementations),
+                        default=sorted(implementations))
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=1,
+                        help="runs per case, the fastest one is kept")
+    parser.add_argument('--captures',
+                        default='./cache/benchmark/',
+                        help="directory the synthetic captures are kept in")
+    parser.add_argument('--output', default='./results/benchmark.json')
+    parser.add_argument('--baseline',
+                        help="benchmark of an earlier version to compare with")
+    parser.add_argument('--max-slowdown',
+                        type=float,
+                        default=0.25,
+                        help="fail if a case got slower by more than this "
+                        "fraction against the baseline")
+    parser.add_argument('--max-memory-increase',
+                        type=float,
+                        default=0.25,
+                        help="fail if the peak RSS of a case grew by more "
+                        "than this fraction against the baseline")
+    args = parser.parse_args()
+
+    results = []
+    for num_traces in args.traces:
+        for num_points in args.samples:
+            directory = synthetic_captures(args.captures, num_traces,
+                                           num_points)
+            for implementation in args.implementations:
+                runs = [
+                    run_case(implementation, directory)
+                    for _ in range(args.repeat)
+                ]
+                case = dict(min(runs, key=lambda run: run['seconds']),
+                            implementation=implementation,
+                            traces=num_traces,
+                            samples=num_points)
+                results.append(case)
+                print("{:<14} {:>6} x {:<5} {:8.2f} s {:10.1f} traces/s "
+                      "{:8.1f} MB {:8.1f} MB per worker{}".format(
+                          implementation, num_traces, num_points,
+                          case['seconds'], case['traces_per_second'],
+                          case['peak_rss_mb'], case['peak_worker_rss_mb'],
+                          '' if case['key_recovered'] else ' (wrong key)'))
+
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        try:
+            regressions = compare(results, baseline, args.max_slowdown,
+                                  args.max_memory_increase)
+        except ValueError as error:
+            print("WARNING: Not comparing against the baseline: {}".format(
+                error))
+
+    with open(args.output, 'w') as file:
+        json.dump({'cpu_count': os.cpu_count(), 'cases': results},
+                  file,
+                  indent=2)
+
+    for regression in regressions:
+        print("ERROR: Regression against the baseline: " + regression)
+    if regressions:
+        sys.exit(1)
@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+
+import argparse
+
+import numpy as np
+
+from analyze_traces import (collect_results, hw_model, hypotheses,
+                            leakage_models, num_guesses, num_subkeys)
+from trace_io import chunks, load_captures
+
+
+class CPAAccumulator:
+    """Online correlation power analysis over chunks of traces.
+
+    Only the running sums of the traces (x) and hypotheses (h) are kept,
+    so the full trace matrix never has to be in memory:
+
+        sum_x, sum_x2  [sample]
+        sum_h, sum_h2  [subkey, guess]
+        sum_xh         [subkey, guess, sample]
+
+    The correlations can be read at any time and two accumulators over
+    disjoint sets of traces can be merged.
+    """
+
+    def __init__(self, num_points, model=hw_model, num_subkeys=num_subkeys,
+                 num_guesses=num_guesses):
+        self.model = model
+        self.num_points = num_points
+        self.num_subkeys = num_subkeys
+        self.num_guesses = num_guesses
+
+        self.num_traces = 0
+        self.sum_x = np.zeros(num_points)
+        self.sum_x2 = np.zeros(num_points)
+        self.sum_h = np.zeros([num_subkeys, num_guesses])
+        self.sum_h2 = np.zeros([num_subkeys, num_guesses])
+        self.sum_xh = np.zeros([num_subkeys, num_guesses, num_points])
+
+    def update(self, trace_chunk, textin_chunk):
+        """Add a chunk of traces [trace, sample] and their plaintexts."""
+        traces = np.asarray(trace_chunk, dtype=np.float64)
+
+        self.num_traces += np.shape(traces)[0]
+        self.sum_x += np.sum(traces, axis=0)
+        self.sum_x2 += np.sum(traces * traces, axis=0)
+
+        for subkey in range(self.num_subkeys):
+            hyps = hypotheses(textin_chunk, subkey, self.model,
+                              self.num_guesses).astype(np.float64)
+            self.sum_h[subkey] += np.sum(hyps, axis=0)
+            self.sum_h2[subkey] += np.sum(hyps * hyps, axis=0)
+            self.sum_xh[subkey] += hyps.T @ traces
+        return self
+
+    def merge(self, other):
+        """Add the sums of another accumulator with the same setup."""
+        if (self.num_points, self.num_subkeys, self.num_guesses) != \
+                (other.num_points, other.num_subkeys, other.num_guesses):
+            raise ValueError("Cannot merge accumulators of different shapes")
+
+        self.num_traces += other.num_traces
+        self.sum_x += other.sum_x
+        self.sum_x2 += other.sum_x2
+        self.sum_h += other.sum_h
+        self.sum_h2 += other.sum_h2
+        self.sum_xh += other.sum_xh
+        return self
+
+    def correlations(self, subkey=None):
+        """Current correlations [subkey, guess, sample].
+
+        If `subkey` is given, only its correlations [guess, sample] are
+        computed.
+        """
+        subkeys = slice(None) if subkey is None else subkey
+        n = self.num_traces
+
+        sum_h = self.sum_h[subkeys][..., np.newaxis]
+        covariances = n * self.sum_xh[subkeys] - sum_h * self.sum_x
+        var_x = n * self.sum_x2 - self.sum_x * self.sum_x
+        var_h = n * self.sum_h2[subkeys][..., np.newaxis] - sum_h * sum_h
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.nan_to_num(covariances / np.sqrt(var_h * var_x))
+
+    def score(self, subkey):
+        """Maximum absolute correlation per guess and the curves of a subkey.
+
+        Same return values as `analyze_traces.correlation`.
+        """
+        plots = abs(self.correlations(subkey))
+        return np.max(plots, axis=1), plots
+
+    def scores(self):
+        """Maximum absolute correlation [subkey, guess].
+
+        Computed one subkey at a time and in place, so only one array of
+        correlations [guess, sample] is in memory, not [subkey, guess,
+        sample] with its temporaries.
+        """
+        n = self.num_traces
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std_x = np.sqrt(n * self.sum_x2 - self.sum_x * self.sum_x)
+            std_h = np.sqrt(n * self.sum_h2 - self.sum_h * self.sum_h)
+
+        scores = np.zeros([self.num_subkeys, self.num_guesses])
+        corrs = np.empty([self.num_guesses, self.num_points])
+        for subkey in range(self.num_subkeys):
+            np.multiply(self.sum_xh[subkey], n, out=corrs)
+            corrs -= np.multiply.outer(self.sum_h[subkey], self.sum_x)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                corrs /= std_h[subkey][:, np.newaxis]
+                corrs /= std_x
+            np.abs(corrs, out=corrs)
+            # fmax skips the 0/0 samples, like the zeros of `correlations`
+            scores[subkey] = np.fmax.reduce(corrs, axis=1)
+        return np.nan_to_num(scores)
+
+    def key_guesses(self):
+        """Best guess of every subkey."""
+        return np.argmax(self.scores(), axis=1)
+
+    def key_ranks(self, known_key):
+        """Rank of the known key byte of every subkey (1 is the best).
+
+        Guesses scoring the same as the known key count against it, so a
+        subkey only has rank 1 once its known key scores strictly best,
+        e.g. not while all correlations are still 0.
+        """
+        scores = self.scores()
+        known = np.asarray(known_key[:self.num_subkeys], dtype=np.intp)
+        ranks = np.full(self.num_subkeys, self.num_guesses + 1)
+        in_range = known < self.num_guesses
+        known_scores = scores[in_range, known[in_range]][:, np.newaxis]
+        # the known key itself is one of the >= scores
+        ranks[in_range] = np.sum(scores[in_range] >= known_scores, axis=1)
+        return ranks
+
+
+def guessing_entropy(ranks):
+    """Average number of key bits left to guess (0 if every rank is 1)."""
+    return np.mean(np.log2(ranks))
+
+
+def track_key_ranks(accumulator, trace_array, textin_array, known_key, step,
+                    stop_after=None):
+    """Feed the traces in steps and record the key ranks after every step.
+
+    Args:
+        accumulator: The `CPAAccumulator` to update.
+        step: Number of traces added between two evaluations.
+        stop_after: Stop once every subkey held rank 1 for this many
+            consecutive steps (process all traces if None).
+
+    Returns:
+        num_traces: Traces processed at every step [step].
+        ranks: Key rank of every subkey [step, subkey].
+        entropies: Guessing entropy [step].
+    """
+    num_traces = []
+    ranks = []
+    entropies = []
+    converged_steps = 0
+
+    for traces in chunks(np.shape(trace_array)[0], step):
+        accumulator.update(trace_array[traces], textin_array[traces])
+        step_ranks = accumulator.key_ranks(known_key)
+
+        num_traces.append(accumulator.num_traces)
+        ranks.append(step_ranks)
+        entropies.append(guessing_entropy(step_ranks))
+        print("{} traces, key ranks: {}, guessing entropy: {:.2f}".format(
+            num_traces[-1], step_ranks, entropies[-1]))
+
+        converged_steps = converged_steps + 1 if np.all(step_ranks == 1) else 0
+        if stop_after and converged_steps >= stop_after:
+            print("INFO: Key recovered, stopping after {} traces".format(
+                num_traces[-1]))
+            break
+
+    return np.asarray(num_traces), np.asarray(ranks), np.asarray(entropies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Streaming CPA over the captured traces")
+    parser.add_argument('--model',
+                        choices=sorted(leakage_models),
+                        default='hw',
+                        help="leakage model")
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=256,
+                        help="number of traces per chunk, the key ranks "
+                        "are evaluated after every chunk")
+    parser.add_argument('--stop-after',
+                        type=int,
+                        help="stop once all subkeys had rank 1 for this "
+                        "many consecutive chunks")
+    args = parser.parse_args()
+
+    # memory mapped, so only one chunk is read at a time
+    trace_array, textin_array, known_keys = load_captures('./captures/')
+    known_key = known_keys[0]
+
+    num_traces, num_points = np.shape(trace_array)
+    accumulator = CPAAccumulator(num_points, leakage_models[args.model])
+    rank_traces, key_ranks, entropies = track_key_ranks(
+        accumulator, trace_array, textin_array, known_key, args.chunk_size,
+        args.stop_after)
+
+    result = collect_results(
+        (accumulator.score(subkey) for subkey in range(num_subkeys)),
+        known_key, num_points)
+
+    # save results
+    result.save('./results/attack_result.npz')
+
+    # key rank vs. number of traces
+    np.save('./results/rank_traces.npy', rank_traces)
+    np.save('./results/key_ranks.npy', key_ranks)
+    np.save('./results/guessing_entropy.npy', entropies)
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from analyze_traces import leakage_models, num_subkeys
+from cpa_accumulator import CPAAccumulator
+from trace_io import chunks, load_captures
+
+
+def measurements_to_disclosure(num_traces, ranks):
+    """Traces after which each subkey keeps rank 1 until the end.
+
+    Args:
+        num_traces: Traces processed at every step [step].
+        ranks: Key rank of every subkey [step, subkey].
+
+    Returns:
+        Measurements to disclosure per subkey, None if not disclosed.
+    """
+    mtds = []
+    for subkey_ranks in np.transpose(ranks):
+        not_first = np.flatnonzero(subkey_ranks != 1)
+        if len(not_first) == 0:
+            mtds.append(int(num_traces[0]))
+        elif not_first[-1] + 1 < len(num_traces):
+            mtds.append(int(num_traces[not_first[-1] + 1]))
+        else:
+            mtds.append(None)
+    return mtds
+
+
+def bootstrap_run(directory, model, step, seed):
+    """MTD per subkey for one bootstrap resample of the captured traces."""
+    trace_array, textin_array, known_keys = load_captures(directory)
+    num_traces, num_points = np.shape(trace_array)
+    known_key = known_keys[0]
+    if not isinstance(trace_array, np.ndarray):
+        # every step reads traces from all over the capture, so an archive
+        # is decompressed once per run instead of at every step
+        trace_array = np.asarray(trace_array)
+
+    # resample with replacement, sorted to read the memory map in order
+    indices = np.random.default_rng(seed).integers(num_traces,
+                                                   size=num_traces)
+    accumulator = CPAAccumulator(num_points, leakage_models[model])
+    steps = []
+    ranks = []
+    for part in chunks(num_traces, step):
+        selected = np.sort(indices[part])
+        accumulator.update(trace_array[selected], textin_array[selected])
+        steps.append(accumulator.num_traces)
+        ranks.append(accumulator.key_ranks(known_key))
+    return measurements_to_disclosure(steps, ranks)
+
+
+def summarize(mtds):
+    """Statistics over the runs of one subkey (or the full key)."""
+    disclosed = [mtd for mtd in mtds if mtd is not None]
+    summary = {'disclosed': len(disclosed) / len(mtds)}
+    for name, value in (('median', np.median), ('mean', np.mean),
+                        ('p90', lambda x: np.percentile(x, 90))):
+        summary[name] = float(value(disclosed)) if disclosed else None
+    return summary
+
+
+def compare(report, baseline):
+    """Relative change of the median MTDs against a previous report."""
+    def change(current, previous):
+        if current['median'] is None or previous['median'] is None:
+            return None
+        return (current['median'] - previous['median']) / previous['median']
+
+    return {
+        'key': change(report['key'], baseline['key']),
+        'subkeys': [
+            change(current, previous) for current, previous in zip(
+                report['subkeys'], baseline['subkeys'])
+        ],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measurements to disclosure from bootstrapped CPA runs")
+    parser.add_argument('--captures',
+                        default='./captures/',
+                        help="directory with the captured .npy arrays")
+    parser.add_argument('--model',
+                        choices=sorted(leakage_models),
+                        default='hw',
+                        help="leakage model")
+    parser.add_argument('--step',
+                        type=int,
+                        default=25,
+                        help="number of traces between two key rank checks")
+    parser.add_argument('--runs',
+                        type=int,
+                        default=20,
+                        help="number of bootstrap resamples")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=os.cpu_count(),
+                        help="number of worker processes")
+    parser.add_argument('--output', default='./results/mtd_report.json')
+    parser.add_argument('--baseline',
+                        help="report of the previous build to compare with")
+    parser.add_argument('--max-decrease',
+                        type=float,
+                        help="fail if the median MTD of the key dropped by "
+                        "more than this fraction against the baseline")
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        runs = list(
+            executor.map(bootstrap_run, [args.captures] * args.runs,
+                         [args.model] * args.runs, [args.step] * args.runs,
+                         [args.seed + run for run in range(args.runs)]))
+
+    # the key falls once its last subkey falls
+    key_mtds = [
+        None if None in run else max(run) for run in runs
+    ]
+    report = {
+        'num_traces': int(np.shape(load_captures(args.captures)[0])[0]),
+        'model': args.model,
+        'step': args.step,
+        'runs': args.runs,
+        'seed': args.seed,
+        'key': summarize(key_mtds),
+        'subkeys': [
+            summarize([run[subkey] for run in runs])
+            for subkey in range(num_subkeys)
+        ],
+    }
+
+    failed = False
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            report['change'] = compare(report, json.load(file))
+        key_change = report['change']['key']
+        failed = (args.max_decrease is not None and key_change is not None
+                  and key_change < -args.max_decrease)
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    print("Key MTD (median of {} runs): {}".format(args.runs,
+                                                   report['key']['median']))
+    for subkey, summary in enumerate(report['subkeys']):
+        print("Subkey {:2}: median {}, disclosed in {:.0%} of the runs".format(
+            subkey, summary['median'], summary['disclosed']))
+    if failed:
+        print("ERROR: Key MTD dropped by {:.0%} against the baseline".format(
+            -report['change']['key']))
+        sys.exit(1)
@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+
+def min_max_indices(curve, num_buckets):
+    """Samples of the minimum and maximum of every bucket.
+
+    Plotting only these keeps every peak of the curve visible while the
+    number of points depends on the plot width instead of the samples.
+
+    Args:
+        curve: Samples [sample].
+        num_buckets: Number of buckets, e.g. the plot width in pixels.
+
+    Returns:
+        Sorted sample indices, at most 2 per bucket plus the end points.
+    """
+    num_points = len(curve)
+    bucket_size = -(-num_points // max(num_buckets, 1))
+    if bucket_size <= 2:
+        return np.arange(num_points)
+
+    num_buckets = -(-num_points // bucket_size)
+    padded = np.pad(np.asarray(curve), (0, num_buckets * bucket_size -
+                                        num_points),
+                    mode='edge').reshape(num_buckets, bucket_size)
+    offsets = np.arange(num_buckets) * bucket_size
+    indices = np.concatenate([
+        offsets + np.argmin(padded, axis=1),
+        offsets + np.argmax(padded, axis=1),
+        [0, num_points - 1],
+    ])
+    return np.unique(np.minimum(indices, num_points - 1))
+
+
+def lod_indices(curve, num_buckets, peak=None, detail=0):
+    """Samples to plot: min/max per bucket, full resolution near the peak.
+
+    Args:
+        curve: Samples [sample].
+        num_buckets: Number of buckets outside the detail window.
+        peak: Center of the detail window (the maximum if None).
+        detail: Number of samples kept on each side of the peak.
+
+    Returns:
+        Sorted sample indices.
+    """
+    indices = min_max_indices(curve, num_buckets)
+    if detail:
+        if peak is None:
+            peak = np.argmax(curve)
+        window = np.arange(max(peak - detail, 0),
+                           min(peak + detail + 1, len(curve)))
+        indices = np.union1d(indices, window)
+    return indices
@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+
+import itertools
+
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+
+from downsample import lod_indices
+
+plot_width = 975  # pixels of the line plot
+bucket_pixels = 4  # pixels per min/max pair of the reduced curves
+
+
+def annotations(labels, scores, precision=5):
+    """Cell texts "<label>\\n<score>" of all cells, without a Python loop."""
+    return np.char.add(np.char.add(labels, '\n'),
+                       np.char.mod('%.{}f'.format(precision), scores))
+
+
+def tableview(result, num_rows=10, annotate_rows=32):
+    """Heatmap of the best `num_rows` guesses of every subkey.
+
+    The cell colors, with the known key marked red, are computed up front
+    and drawn as a single image. Above `annotate_rows` rows only the known
+    key cells are labeled, so the text layout stays bounded for all 256
+    guesses.
+    """
+    scores = result.sorted_scores[:, :num_rows].T  # [rank, subkey]
+    color_mask = result.color_mask[:, :num_rows].T
+    num_rows, num_subkeys = np.shape(scores)
+
+    # the color scale covers the other guesses, like the masked seaborn map
+    others = scores[~color_mask] if not np.all(color_mask) else scores
+    my_cmap = plt.get_cmap('BuGn_r')
+    colors = my_cmap(plt.Normalize(np.min(others), np.max(others))(scores))
+    colors[color_mask] = matplotlib.colors.to_rgba('#D22B31')  # known key
+
+    fig, ax = plt.subplots(figsize=(20, max(15, 0.3 * num_rows)))
+    ax.imshow(colors, aspect='auto', interpolation='nearest')
+    ax.xaxis.tick_top()
+    ax.xaxis.set_label_position('top')
+    ax.set_xticks(np.arange(num_subkeys))
+    ax.set_yticks(np.arange(num_rows))
+
+    if num_rows <= annotate_rows:
+        cells = np.ones_like(color_mask)
+    else:
+        cells = color_mask
+    ranks, subkeys = np.nonzero(cells)
+    # only the hex labels of the shown rows are created
+    texts = annotations(result.hex_labels(num_rows).T,
+                        scores)[ranks, subkeys]
+    # white text on dark and red cells, with the luminance seaborn uses
+    rgb = colors[ranks, subkeys, :3]
+    rgb = np.where(rgb <= 0.03928, rgb / 12.92, ((rgb + 0.055) / 1.055)**2.4)
+    luminance = rgb @ [0.2126, 0.7152, 0.0722]
+    text_colors = np.where(
+        (luminance < 0.408) | color_mask[ranks, subkeys], 'w', 'k')
+    for rank, subkey, text, color in zip(ranks, subkeys, texts, text_colors):
+        ax.text(subkey, rank, text, color=color, fontweight='bold',
+                ha='center', va='center')
+
+    ax.set_xlabel('Subkey\n', fontweight='bold', fontsize=14)
+    ax.set_ylabel('Key Guess\n', fontweight='bold', fontsize=14)
+    return fig
+
+
+def write_table(results, path, num_rows=10, run_names=None):
+    """Best guesses of one or more results as a CSV or HTML table.
+
+    The CSV has one line per run, subkey and rank, which scales to
+    comparisons of many runs. The HTML table has a row per rank and a
+    column per subkey (and run), the known key is marked.
+
+    Args:
+        results: List of `AttackResult`.
+        path: Output file, the extension selects .csv or .html.
+        run_names: Name of every result (0, 1, ... if None).
+    """
+    if run_names is None:
+        run_names = [str(run) for run in range(len(results))]
+
+    if path.endswith('.csv'):
+        lines = ['run,subkey,rank,guess,score,known']
+        for name, result in zip(run_names, results):
+            order = result.order[:, :num_rows]
+            scores = result.sorted_scores[:, :num_rows]
+            subkeys, ranks = np.indices(np.shape(order))
+            columns = [
+                np.full(np.shape(order), name), subkeys, ranks + 1,
+                result.hex_labels(num_rows),
+                np.char.mod('%.5f', scores),
+                result.color_mask[:, :num_rows].astype(int)
+            ]
+            rows = columns[0].astype(str)
+            for column in columns[1:]:
+                rows = np.char.add(np.char.add(rows, ','), column.astype(str))
+            lines += list(rows.ravel())
+        text = '\n'.join(lines) + '\n'
+    else:
+        header = ''.join(
+            '<th>{}</th>'.format(subkey if len(results) == 1 else
+                                 '{} {}'.format(name, subkey))
+            for name, result in zip(run_names, results)
+            for subkey in range(len(result.scores)))
+        cells = np.concatenate([
+            np.char.add(
+                np.where(result.color_mask[:, :num_rows].T,
+                         '<td class="known">', '<td>'),
+                annotations(result.hex_labels(num_rows),
+                            result.sorted_scores[:, :num_rows]).T)
+            for result in results
+        ], axis=1)
+        cells = np.char.add(np.char.replace(cells, '\n', '<br>'), '</td>')
+        body = '\n'.join('<tr><th>{}</th>{}</tr>'.format(rank, ''.join(row))
+                          for rank, row in enumerate(cells, 1))
+        text = ('<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+                '<style>td, th {{font: bold 12px monospace; padding: 2px 6px;'
+                ' text-align: center}} td.known {{background: #D22B31;'
+                ' color: white}}</style></head><body><table>\n'
+                '<tr><th>Rank</th>{}</tr>\n{}\n</table></body></html>\n'
+                ).format(header, body)
+
+    with open(path, 'w') as file:
+        file.write(text)
+
+
+def curve_samples(result, lod=True, detail=250, width=plot_width):
+    """Samples to plot of the best curve of every subkey.
+
+    With `lod` every curve is reduced to the min/max per `bucket_pixels`
+    pixels, only the `detail` samples on each side of its peak keep full
+    resolution.
+
+    Returns:
+        List of (guess, samples, values) per subkey. The samples are int32,
+        which bokeh embeds as binary instead of a JSON list.
+    """
+    key_guesses = result.key_guesses
+    peaks = result.peaks[np.arange(len(key_guesses)), key_guesses]
+
+    curves = []
+    for curve, guess, peak in zip(result.best_curves, key_guesses, peaks):
+        if lod:
+            samples = lod_indices(curve, width // bucket_pixels, peak,
+                                  detail)
+        else:
+            samples = np.arange(len(curve))
+        curves.append((guess, samples.astype(np.int32), curve[samples]))
+    return curves
+
+
+def line_plot(result, lod=True, detail=250, width=plot_width):
+    """Interactive bokeh plot of the best curve of every subkey.
+
+    Only subkey 0 is visible, the others are shown from the legend.
+    """
+    from bokeh.models import Legend, NumeralTickFormatter
+    from bokeh.palettes import Dark2_5
+    from bokeh.plotting import figure
+
+    curves = curve_samples(result, lod, detail, width)
+
+    p = figure()
+
+    p.plot_width = width
+    p.yaxis[0].formatter = NumeralTickFormatter(format="0.0000")
+    colors = itertools.cycle(Dark2_5[:len(curves)])
+
+    legend1_items, legend2_items = [], []
+    for i, ((guess, samples, values),
+            color) in enumerate(zip(curves, colors)):
+        line = p.line(x=samples, y=values, color=color)
+        line.visible = True if i == 0 else False
+        legend_item = (str(i) + ': ' + str(hex(int(guess))), [line])
+        if i <= len(curves) / 2:
+            legend1_items.append(legend_item),
+        else:
+            legend2_items.append(legend_item),
+
+    legend1 = Legend(items=legend1_items,
+                     location=(7, 2),
+                     spacing=10,
+                     label_width=10,
+                     label_text_font_style='bold',
+                     orientation="horizontal")
+
+    legend2 = Legend(items=legend2_items,
+                     location=(7, 2),
+                     spacing=10,
+                     label_width=10,
+                     label_text_font_style='bold',
+                     orientation="horizontal")
+
+    p.add_layout(legend1, 'below')
+    p.add_layout(legend2, 'below')
+
+    p.legend.click_policy = "hide"
+    return p
+
+
+def line_plot_image(result, lod=True, detail=250, width=plot_width):
+    """Static version of `line_plot`: one panel per subkey."""
+    curves = curve_samples(result, lod, detail, width)
+    num_columns = 4
+    num_rows = -(-len(curves) // num_columns)
+
+    fig, axes = plt.subplots(num_rows,
+                             num_columns,
+                             figsize=(20, 3 * num_rows),
+                             sharex=True,
+                             squeeze=False)
+    for i, ((guess, samples, values), ax) in enumerate(
+            zip(curves, axes.flat)):
+        ax.plot(samples, values, linewidth=0.8)
+        ax.set_title('{}: {}'.format(i, hex(int(guess))), fontweight='bold')
+    for ax in axes.flat[len(curves):]:
+        ax.set_visible(False)
+    fig.tight_layout()
+    return fig
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+import hashlib
+import os
+
+import numpy as np
+
+# every key byte value, the attacks use the first `num_guesses` of them
+all_guesses = np.arange(256, dtype=np.uint8)
+
+
+def intermediate_table(textin_array):
+    """SBox outputs of all subkeys and guesses [trace, subkey, guess].
+
+    Built with a single fancy-indexing gather; the traces stay the first
+    axis so chunks of traces are sliced like the plaintexts.
+    """
+    from analyze_traces import sbox_table
+
+    textin_array = np.asarray(textin_array, dtype=np.uint8)
+    return sbox_table[textin_array[:, :, np.newaxis] ^ all_guesses]
+
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-256 of a file, read in blocks."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def array_hash(array):
+    """SHA-256 of the shape and bytes of an array."""
+    array = np.ascontiguousarray(array)
+    sha = hashlib.sha256(str((array.shape, array.dtype.str)).encode())
+    sha.update(memoryview(array).cast('B'))
+    return sha.hexdigest()
+
+
+def load_intermediate_table(textin_array, cache_dir='./cache/',
+                            max_bytes=512 * 2**20):
+    """Load the intermediate table of a set of plaintexts from the cache.
+
+    The table is keyed by the hash of the plaintexts, so it works for .npy
+    captures and trace archives alike, and is only computed (and stored)
+    if it is not cached yet. It is returned memory mapped. The least
+    recently used tables are removed once the cache grows beyond
+    `max_bytes`, like in `result_cache.ResultCache`.
+    """
+    textin_array = np.asarray(textin_array, dtype=np.uint8)
+    key = array_hash(textin_array)
+    path = os.path.join(cache_dir, 'intermediates-{}.npy'.format(key))
+    if os.path.exists(path):
+        os.utime(path)  # mark as recently used
+    else:
+        os.makedirs(cache_dir, exist_ok=True)
+        table = intermediate_table(textin_array)
+        # write to a temporary file first, so an aborted run leaves no
+        # broken cache entry behind
+        temp_path = path + '.tmp.npy'
+        np.save(temp_path, table)
+        os.replace(temp_path, path)
+        print("INFO: Cached intermediate values in " + path)
+        evict_intermediate_tables(cache_dir, max_bytes, keep=path)
+    return np.load(path, mmap_mode='r')
+
+
+def evict_intermediate_tables(cache_dir, max_bytes, keep=None):
+    """Remove the least recently used tables above the size limit.
+
+    The table `keep` (the one just stored) is never removed.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith('intermediates-') and name.endswith('.npy') \
+                and not name.endswith('.tmp.npy') and path != keep:
+            entries.append(
+                (os.path.getmtime(path), os.path.getsize(path), path))
+
+    total = sum(size for _, size, _ in entries)
+    if keep is not None:
+        total += os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
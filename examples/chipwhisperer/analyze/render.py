@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import matplotlib
+
+matplotlib.use('Agg')  # no display needed
+
+import matplotlib.pyplot as plt  # noqa: E402
+
+from attack_result import AttackResult  # noqa: E402
+from figures import (line_plot, line_plot_image, tableview,  # noqa: E402
+                     write_table)
+from hypothesis_cache import file_hash  # noqa: E402
+from result_cache import ResultCache, source_hashes  # noqa: E402
+from timing import Timings  # noqa: E402
+
+result_name = 'attack_result.npz'
+formats = ('png', 'svg', 'html', 'csv')
+render_sources = ('render.py', 'figures.py', 'downsample.py',
+                  'attack_result.py')
+
+
+def figure_names(image_formats):
+    """Files written by `render` for the given formats."""
+    names = []
+    for image_format in image_formats:
+        if image_format == 'html':
+            names += ['tableview.html', 'line_plot.html']
+        elif image_format == 'csv':
+            names.append('tableview.csv')
+        else:
+            names += [
+                'tableview.' + image_format, 'line_plot.' + image_format
+            ]
+    return names
+
+
+def render_fingerprint(results_dir, parameters):
+    """Hash of the result file, the render parameters and the plotting
+    code."""
+    sha = hashlib.sha256()
+    sha.update(file_hash(os.path.join(results_dir, result_name)).encode())
+    sha.update(json.dumps(parameters, sort_keys=True).encode())
+    sha.update(json.dumps(source_hashes(render_sources),
+                          sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+def render(result, output, image_formats, num_rows=10, lod=True, detail=250,
+           timings=None):
+    """Write the heatmap and line plot of `result` to `output`."""
+    timings = Timings('render') if timings is None else timings
+    os.makedirs(output, exist_ok=True)
+
+    images = [image_format for image_format in image_formats
+              if image_format in ('png', 'svg')]
+    if images:
+        with timings.stage('tableview'):
+            fig = tableview(result, num_rows)
+            for image_format in images:
+                fig.savefig(os.path.join(output,
+                                         'tableview.' + image_format),
+                            bbox_inches='tight')
+            plt.close(fig)
+
+        with timings.stage('line_plot'):
+            fig = line_plot_image(result, lod, detail)
+            for image_format in images:
+                fig.savefig(os.path.join(output,
+                                         'line_plot.' + image_format))
+            plt.close(fig)
+
+    for table_format in ('html', 'csv'):
+        if table_format in image_formats:
+            with timings.stage('table_' + table_format):
+                write_table([result],
+                            os.path.join(output, 'tableview.' + table_format),
+                            num_rows)
+
+    if 'html' in image_formats:
+        from bokeh.embed import file_html
+        from bokeh.resources import INLINE
+
+        with timings.stage('line_plot_html'):
+            html = file_html(line_plot(result, lod, detail), INLINE,
+                             'Attack result')
+            with open(os.path.join(output, 'line_plot.html'), 'w') as file:
+                file.write(html)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render the figures of the report without a notebook")
+    parser.add_argument('--results',
+                        default='./results/',
+                        help="directory with attack_result.npz")
+    parser.add_argument('--output', default='./figures/')
+    parser.add_argument('--formats',
+                        nargs='+',
+                        choices=formats,
+                        default=list(formats))
+    parser.add_argument('--rows',
+                        type=int,
+                        default=10,
+                        help="best guesses shown per subkey in the heatmap")
+    parser.add_argument('--no-lod',
+                        action='store_true',
+                        help="plot all samples instead of the min/max per "
+                        "4 pixels")
+    parser.add_argument('--detail',
+                        type=int,
+                        default=250,
+                        help="full resolution samples on each side of a "
+                        "peak")
+    parser.add_argument('--render-cache',
+                        default='./cache/render/',
+                        help="directory caching the figures per result "
+                        "file (empty to disable)")
+    parser.add_argument('--render-cache-size',
+                        type=int,
+                        default=128,
+                        help="size limit of the render cache in MB")
+    args = parser.parse_args()
+
+    names = figure_names(args.formats)
+    lod = not args.no_lod
+
+    # skip rendering if the same results were already rendered the same way
+    if args.render_cache:
+        render_cache = ResultCache(args.render_cache,
+                                   args.render_cache_size * 2**20)
+        fingerprint = render_fingerprint(args.results, {
+            'formats': sorted(args.formats),
+            'rows': args.rows,
+            'lod': lod,
+            'detail': args.detail,
+        })
+        if render_cache.get(fingerprint, args.output, names):
+            print("INFO: Results unchanged, reusing the cached figures")
+            sys.exit(0)
+
+    timings = Timings('render')
+    result = AttackResult.load(os.path.join(args.results, result_name))
+    render(result, args.output, args.formats, args.rows, lod, args.detail,
+           timings)
+    timings.print()
+
+    if args.render_cache:
+        render_cache.put(fingerprint, args.output, names)
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import os
+import shutil
+
+from hypothesis_cache import file_hash
+
+# input files of a captures directory that determine the results
+capture_files = ('trace_array.npy', 'textin_array.npy', 'known_keys.npy',
+                 'traces.cwta', 'poi_map.npz')
+
+# analysis code the results depend on, a change invalidates the cache
+analysis_sources = ('analyze_traces.py', 'attack_result.py',
+                    'second_order.py', 'trace_io.py', 'hypothesis_cache.py')
+
+
+def source_hashes(names, directory=os.path.dirname(os.path.abspath(__file__))):
+    """Hash of every source file in `names` (relative to `directory`)."""
+    return {name: file_hash(os.path.join(directory, name)) for name in names}
+
+
+def capture_fingerprint(directory, parameters, sources=analysis_sources):
+    """Hash of the capture files of `directory`, the attack parameters and
+    the analysis sources."""
+    sha = hashlib.sha256()
+    for name in capture_files:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            sha.update('{}:{}\n'.format(name, file_hash(path)).encode())
+    sha.update(json.dumps(parameters, sort_keys=True).encode())
+    sha.update(json.dumps(source_hashes(sources), sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+class ResultCache:
+    """Directory of result files keyed by a fingerprint.
+
+    Every entry is a subdirectory holding copies of the result files. The
+    least recently used entries are removed once the cache grows beyond
+    `max_bytes`.
+    """
+
+    def __init__(self, directory='./cache/results/', max_bytes=512 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key, results_dir, names):
+        """Copy the cached results of `key` to `results_dir` if present."""
+        entry = self._entry(key)
+        paths = [os.path.join(entry, name) for name in names]
+        if not all(os.path.exists(path) for path in paths):
+            return False
+
+        os.makedirs(results_dir, exist_ok=True)
+        for name, path in zip(names, paths):
+            shutil.copyfile(path, os.path.join(results_dir, name))
+        os.utime(entry)  # mark as recently used
+        return True
+
+    def put(self, key, results_dir, names):
+        """Store the result files of `results_dir` under `key`."""
+        entry = self._entry(key)
+        temp_entry = entry + '.tmp'
+        shutil.rmtree(temp_entry, ignore_errors=True)
+        os.makedirs(temp_entry)
+        for name in names:
+            shutil.copyfile(os.path.join(results_dir, name),
+                            os.path.join(temp_entry, name))
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(temp_entry, entry)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries above the size limit."""
+        entries = []
+        for key in os.listdir(self.directory):
+            entry = self._entry(key)
+            if os.path.isdir(entry) and not key.endswith('.tmp'):
+                size = sum(
+                    os.path.getsize(os.path.join(entry, name))
+                    for name in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
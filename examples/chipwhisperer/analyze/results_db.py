@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from attack_result import AttackResult
+from hypothesis_cache import file_hash
+from trace_io import load_captures
+
+schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created TEXT NOT NULL,
+    build TEXT,
+    firmware_hash TEXT,
+    platform TEXT,
+    crypto_target TEXT,
+    num_traces INTEGER,
+    num_points INTEGER,
+    mode TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_firmware ON runs (firmware_hash);
+CREATE INDEX IF NOT EXISTS runs_target ON runs (platform, crypto_target);
+CREATE TABLE IF NOT EXISTS subkeys (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    subkey INTEGER NOT NULL,
+    known_rank INTEGER,
+    key_guess INTEGER,
+    score REAL,
+    peak INTEGER,
+    PRIMARY KEY (subkey, run_id)
+);
+'''
+
+
+class ResultsDatabase:
+    """History of attack results across firmware builds.
+
+    The per-run metadata and the per-subkey summary (rank of the known key,
+    best guess, its score and peak sample) live in SQLite, so queries over
+    many runs never touch the arrays. The `AttackResult` of every run is
+    kept next to the database as a compressed `blobs/<run id>.npz`. Unless
+    all curves are requested, only the curves of the best guess and of the
+    known key byte are stored, the others are zeros which compress to
+    almost nothing.
+    """
+
+    def __init__(self, path='./history/results.sqlite'):
+        self.path = path
+        self.blob_dir = os.path.join(os.path.dirname(path) or '.', 'blobs')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(schema)
+
+    def close(self):
+        self.connection.close()
+
+    def add_run(self, result_path, firmware_hash=None, platform=None,
+                crypto_target=None, num_traces=None, mode=None, build=None,
+                all_curves=False):
+        """Store the attack_result.npz of a run, returns the run id."""
+        result = AttackResult.load(result_path)
+        num_subkeys, _, num_points = np.shape(result.curves)
+        subkeys = np.arange(num_subkeys)
+        key_guesses = result.key_guesses
+
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO runs (created, build, firmware_hash, platform, '
+                'crypto_target, num_traces, num_points, mode) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (time.strftime('%Y-%m-%dT%H:%M:%S'), build, firmware_hash,
+                 platform, crypto_target, num_traces, num_points, mode))
+            run_id = cursor.lastrowid
+            self.connection.executemany(
+                'INSERT INTO subkeys VALUES (?, ?, ?, ?, ?, ?)',
+                zip([run_id] * num_subkeys, subkeys.tolist(),
+                    result.known_ranks.tolist(), key_guesses.tolist(),
+                    result.scores[subkeys, key_guesses].tolist(),
+                    result.peaks[subkeys, key_guesses].tolist()))
+            if not all_curves:
+                result.curves = self._kept_curves(result)
+            result.save(self.blob_path(run_id), compressed=True)
+        return run_id
+
+    @staticmethod
+    def _kept_curves(result):
+        """Curves of the best guess and known key byte, zeros elsewhere."""
+        num_subkeys, num_guesses, _ = np.shape(result.curves)
+        subkeys = np.arange(num_subkeys)
+        known = np.asarray(result.known_key, dtype=np.intp)
+        in_range = known < num_guesses
+
+        curves = np.zeros_like(result.curves)
+        for rows, guesses in ((subkeys, result.key_guesses),
+                              (subkeys[in_range], known[in_range])):
+            curves[rows, guesses] = result.curves[rows, guesses]
+        return curves
+
+    def prune_blobs(self, keep):
+        """Delete the blobs of all but the newest `keep` runs.
+
+        The summaries of the pruned runs stay in the database, only
+        `load_result` is no longer available for them.
+        """
+        cursor = self.connection.execute(
+            'SELECT id FROM runs ORDER BY id DESC LIMIT -1 OFFSET ?', [keep])
+        pruned = 0
+        for run_id, in cursor:
+            if os.path.exists(self.blob_path(run_id)):
+                os.remove(self.blob_path(run_id))
+                pruned += 1
+        return pruned
+
+    def blob_path(self, run_id):
+        return os.path.join(self.blob_dir, '{}.npz'.format(run_id))
+
+    def load_result(self, run_id):
+        """The full `AttackResult` of a run."""
+        return AttackResult.load(self.blob_path(run_id))
+
+    def runs(self, last=None, **filters):
+        """Metadata of the runs, newest first.
+
+        Args:
+            last: Only the newest `last` runs (all if None).
+            filters: Column values to match, e.g. platform='CWLITEARM'.
+        """
+        where, values = self._where(filters)
+        cursor = self.connection.execute(
+            'SELECT * FROM runs {} ORDER BY id DESC LIMIT ?'.format(where),
+            values + [-1 if last is None else last])
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def rank_history(self, subkey, last=50, **filters):
+        """Rank of the known key byte of `subkey` over the newest runs.
+
+        Returns:
+            List of (run id, build, firmware hash, number of traces, rank),
+            oldest first.
+        """
+        where, values = self._where(filters, prefix='runs.')
+        cursor = self.connection.execute(
+            'SELECT runs.id, runs.build, runs.firmware_hash, runs.num_traces,'
+            ' subkeys.known_rank FROM runs JOIN subkeys ON '
+            'subkeys.run_id = runs.id AND subkeys.subkey = ? {} '
+            'ORDER BY runs.id DESC LIMIT ?'.format(where),
+            [subkey] + values + [last])
+        return cursor.fetchall()[::-1]
+
+    @staticmethod
+    def _where(filters, prefix=''):
+        filters = {
+            column: value
+            for column, value in filters.items() if value is not None
+        }
+        if not filters:
+            return '', []
+        for column in filters:
+            if column not in ('build', 'firmware_hash', 'platform',
+                              'crypto_target', 'num_traces', 'mode'):
+                raise ValueError("Unknown run column: " + column)
+        return ('WHERE ' + ' AND '.join(prefix + column + ' = ?'
+                                        for column in filters),
+                list(filters.values()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Store and compare attack results across builds")
+    parser.add_argument('--database', default='./history/results.sqlite')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add = subparsers.add_parser('add', help="store the results of a run")
+    add.add_argument('--results', default='./results/attack_result.npz')
+    add.add_argument('--captures',
+                     default='./captures/',
+                     help="captures the results were computed from (for "
+                     "the number of traces)")
+    add.add_argument('--firmware', help="firmware image (.hex) to hash")
+    add.add_argument('--platform', default='CWLITEARM')
+    add.add_argument('--crypto-target', default='TINYAES128C')
+    add.add_argument('--mode', help="attack mode of analyze_traces.py")
+    add.add_argument('--build', help="build number, e.g. $BUILD_NUMBER")
+    add.add_argument('--all-curves',
+                     action='store_true',
+                     help="keep the curves of every guess, not only of the "
+                     "best guess and the known key")
+    add.add_argument('--keep',
+                     type=int,
+                     help="delete the stored results of all but the newest "
+                     "KEEP runs (their summaries are kept)")
+
+    query = subparsers.add_parser('ranks',
+                                  help="key rank of a subkey over the runs")
+    query.add_argument('--subkey', type=int, default=0)
+    query.add_argument('--last', type=int, default=50)
+    query.add_argument('--platform')
+    query.add_argument('--crypto-target')
+    query.add_argument('--firmware-hash')
+    args = parser.parse_args()
+
+    database = ResultsDatabase(args.database)
+    if args.command == 'add':
+        num_traces = None
+        if os.path.isdir(args.captures):
+            num_traces = int(np.shape(load_captures(args.captures)[0])[0])
+        run_id = database.add_run(
+            args.results,
+            firmware_hash=file_hash(args.firmware) if args.firmware else None,
+            platform=args.platform,
+            crypto_target=args.crypto_target,
+            num_traces=num_traces,
+            mode=args.mode,
+            build=args.build,
+            all_curves=args.all_curves)
+        print("INFO: Stored the results as run {}".format(run_id))
+        if args.keep is not None:
+            print("INFO: Deleted the results of {} older runs".format(
+                database.prune_blobs(args.keep)))
+    else:
+        for run_id, build, firmware_hash, num_traces, rank in \
+                database.rank_history(args.subkey, args.last,
+                                      platform=args.platform,
+                                      crypto_target=args.crypto_target,
+                                      firmware_hash=args.firmware_hash):
+            print("run {:5} build {:>6} firmware {} {:>7} traces: "
+                  "subkey {} rank {}".format(run_id, build or '-',
+                                             (firmware_hash or '-')[:12],
+                                             num_traces or '-', args.subkey,
+                                             rank))
+    database.close()
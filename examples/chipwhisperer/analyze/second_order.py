@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+from analyze_traces import (hw_model, hypotheses, num_guesses, num_subkeys)
+from trace_io import chunks, read_chunk
+
+
+def combine(block_i, block_j, method='product'):
+    """Combine every sample of `block_i` with every sample of `block_j`.
+
+    Args:
+        block_i, block_j: Traces [trace, sample], already centered for the
+            centered product.
+        method: 'product' (centered product) or 'absdiff' (absolute
+            difference).
+
+    Returns:
+        Combined traces [trace, sample i, sample j].
+    """
+    if method == 'product':
+        return block_i[:, :, np.newaxis] * block_j[:, np.newaxis, :]
+    if method == 'absdiff':
+        return abs(block_i[:, :, np.newaxis] - block_j[:, np.newaxis, :])
+    raise ValueError("Unknown combining method " + method)
+
+
+def second_order_scores(trace_array, textin_array, pair_window=slice(None),
+                        model=hw_model, method='product', block_size=32,
+                        chunk_size=None, num_subkeys=num_subkeys,
+                        num_guesses=num_guesses):
+    """Second-order CPA on all sample pairs of a window.
+
+    The sample pairs (i < j) of `pair_window` are combined and correlated
+    with the hypotheses of all subkeys. The pairs are processed in tiles of
+    `block_size` x `block_size` samples and the traces in chunks, so only
+    one tile of combined traces is in memory at a time.
+
+    Returns:
+        (scores [guess], plots [guess, sample]) per subkey like
+        `analyze_traces.correlation`. A sample of the curves holds the best
+        correlation of all pairs it is part of.
+    """
+    num_traces, num_points = np.shape(trace_array)
+    samples = np.arange(num_points)[pair_window]
+    num_samples = len(samples)
+
+    # sample means for the centered product
+    means = 0
+    for traces in chunks(num_traces, chunk_size):
+        means += np.sum(read_chunk(trace_array, traces, samples), axis=0)
+    means /= num_traces
+    if method != 'product':
+        means = np.zeros(num_samples)
+
+    # hypotheses of all subkeys next to each other [trace, subkey * guess],
+    # computed once per chunk and kept in the small integer type of the
+    # model, so all chunks fit in memory next to the traces
+    trace_chunks = chunks(num_traces, chunk_size)
+    chunk_hypotheses = [
+        np.concatenate([
+            hypotheses(textin_array[traces], subkey, model, num_guesses)
+            for subkey in range(num_subkeys)
+        ], axis=1) for traces in trace_chunks
+    ]
+
+    sum_h = 0
+    sum_h2 = 0
+    for hyps in chunk_hypotheses:
+        hyps = hyps.astype(np.float64)
+        sum_h += np.sum(hyps, axis=0)
+        sum_h2 += np.sum(hyps * hyps, axis=0)
+    var_h = num_traces * sum_h2 - sum_h * sum_h
+
+    plots = np.zeros([num_subkeys * num_guesses, num_points])
+    blocks = chunks(num_samples, block_size)
+    for index_i, block_i in enumerate(blocks):
+        for block_j in blocks[index_i:]:
+            sum_c = 0
+            sum_c2 = 0
+            sum_hc = 0
+            for traces, hyps in zip(trace_chunks, chunk_hypotheses):
+                centered = read_chunk(trace_array, traces, samples) - means
+                combined = combine(centered[:, block_i], centered[:, block_j],
+                                   method)
+                combined = combined.reshape(len(combined), -1)
+                sum_c += np.sum(combined, axis=0)
+                sum_c2 += np.sum(combined * combined, axis=0)
+                sum_hc += hyps.T.astype(np.float64) @ combined
+
+            covariances = num_traces * sum_hc - np.outer(sum_h, sum_c)
+            var_c = num_traces * sum_c2 - sum_c * sum_c
+            with np.errstate(divide='ignore', invalid='ignore'):
+                corrs = abs(
+                    np.nan_to_num(covariances / np.sqrt(np.outer(var_h,
+                                                                 var_c))))
+
+            # only the pairs i < j
+            pair_i = np.arange(block_i.start, block_i.stop)[:, np.newaxis]
+            pair_j = np.arange(block_j.start, block_j.stop)[np.newaxis, :]
+            corrs = corrs.reshape(-1, len(pair_i), np.shape(pair_j)[1])
+            corrs = np.where(pair_i < pair_j, corrs, 0)
+
+            points_i = samples[block_i]
+            points_j = samples[block_j]
+            plots[:, points_i] = np.maximum(plots[:, points_i],
+                                            np.max(corrs, axis=2))
+            plots[:, points_j] = np.maximum(plots[:, points_j],
+                                            np.max(corrs, axis=1))
+
+    plots = plots.reshape(num_subkeys, num_guesses, num_points)
+    return [(np.max(subkey_plots, axis=1), subkey_plots)
+            for subkey_plots in plots]
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+
+import numpy as np
+
+from analyze_traces import hamming_weight, num_subkeys, sbox_table
+from trace_io import chunks, load_captures, read_chunk
+from tvla import TTest, fixed_group
+
+# Hamming weight classes of the SBox output
+num_classes = 9
+
+
+class ClassStatistics:
+    """Per-sample count, sum and sum of squares per subkey and class.
+
+    The classes are the Hamming weights of the SBox output under the known
+    key. All statistics are accumulated in one pass over the traces.
+    """
+
+    def __init__(self, num_points, num_subkeys=num_subkeys):
+        self.counts = np.zeros([num_subkeys, num_classes])
+        self.sums = np.zeros([num_subkeys, num_classes, num_points])
+        self.squares = np.zeros([num_subkeys, num_classes, num_points])
+
+    def update(self, traces, textin_chunk, known_key):
+        traces = np.asarray(traces, dtype=np.float64)
+        classes = hamming_weight[sbox_table[textin_chunk ^ known_key]]
+        for subkey in range(len(self.counts)):
+            one_hot = (classes[:, subkey, np.newaxis] ==
+                       np.arange(num_classes)).astype(np.float64)
+            self.counts[subkey] += np.sum(one_hot, axis=0)
+            self.sums[subkey] += one_hot.T @ traces
+            self.squares[subkey] += one_hot.T @ (traces * traces)
+        return self
+
+    def _moments(self):
+        counts = self.counts[:, :, np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = self.sums / counts
+            variances = self.squares / counts - means * means
+        return counts, means, variances
+
+    def snr(self):
+        """Signal to noise ratio [subkey, sample]."""
+        counts, means, variances = self._moments()
+        used = counts > 0
+        weights = counts / np.sum(counts, axis=1, keepdims=True)
+        mean = np.sum(np.where(used, weights * means, 0), axis=1,
+                      keepdims=True)
+        signal = np.sum(np.where(used, weights * (means - mean)**2, 0), axis=1)
+        noise = np.sum(np.where(used, weights * variances, 0), axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.nan_to_num(signal / noise)
+
+    def sost(self):
+        """Sum of squared pairwise t-differences [subkey, sample]."""
+        counts, means, variances = self._moments()
+        sost = 0
+        for i in range(num_classes):
+            for j in range(i + 1, num_classes):
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    t = (means[:, i] - means[:, j])**2 / (
+                        variances[:, i] / counts[:, i] +
+                        variances[:, j] / counts[:, j])
+                sost = sost + np.nan_to_num(t, posinf=0)
+        return sost
+
+
+def select_windows(statistic, num_windows, width):
+    """Indices of the top windows around the highest samples.
+
+    Args:
+        statistic: Score per sample.
+        num_windows: Number of peaks to keep.
+        width: Number of samples kept around each peak.
+
+    Returns:
+        Sorted, unique sample indices.
+    """
+    num_points = len(statistic)
+    remaining = np.array(statistic, dtype=np.float64)
+    indices = []
+    for _ in range(min(num_windows, num_points)):
+        peak = int(np.argmax(remaining))
+        start = max(peak - width // 2, 0)
+        stop = min(start + width, num_points)
+        indices.append(np.arange(start, stop))
+        remaining[start:stop] = -np.inf  # next peak outside this window
+        if np.all(np.isneginf(remaining)):
+            break
+    return np.unique(np.concatenate(indices))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Select the points of interest of the captured traces")
+    parser.add_argument('--captures',
+                        default='./captures/',
+                        help="directory with the captured .npy arrays")
+    parser.add_argument('--output',
+                        default='./poi/',
+                        help="directory for the reduced .npy arrays")
+    parser.add_argument('--method',
+                        choices=['snr', 'sost', 'ttest'],
+                        default='snr',
+                        help="per-sample statistic (ttest: fixed vs. random)")
+    parser.add_argument('--windows',
+                        type=int,
+                        default=32,
+                        help="number of windows to keep")
+    parser.add_argument('--width',
+                        type=int,
+                        default=10,
+                        help="samples per window")
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=1000,
+                        help="number of traces read at once")
+    args = parser.parse_args()
+
+    trace_array, textin_array, known_keys = load_captures(args.captures)
+    num_traces, num_points = np.shape(trace_array)
+
+    # one pass over the traces for the statistics
+    if args.method == 'ttest':
+        stats = TTest(num_points)
+        fixed = fixed_group(textin_array)
+        for traces in chunks(num_traces, args.chunk_size):
+            stats.update(read_chunk(trace_array, traces), fixed[traces])
+        statistic = abs(stats.t_statistic())
+    else:
+        stats = ClassStatistics(num_points)
+        for traces in chunks(num_traces, args.chunk_size):
+            stats.update(read_chunk(trace_array, traces),
+                         textin_array[traces], known_keys[0])
+        # the points of interest of any subkey
+        statistic = np.max(getattr(stats, args.method)(), axis=0)
+
+    indices = select_windows(statistic, args.windows, args.width)
+
+    # second pass to write the reduced traces
+    os.makedirs(args.output, exist_ok=True)
+    reduced = np.lib.format.open_memmap(os.path.join(args.output,
+                                                     'trace_array.npy'),
+                                        mode='w+',
+                                        dtype=trace_array.dtype,
+                                        shape=(num_traces, len(indices)))
+    for traces in chunks(num_traces, args.chunk_size):
+        reduced[traces] = trace_array[traces][:, indices]
+    reduced.flush()
+
+    # saved from the loaded arrays, the captures may be a trace archive
+    np.save(os.path.join(args.output, 'textin_array.npy'), textin_array)
+    np.save(os.path.join(args.output, 'known_keys.npy'), known_keys)
+    np.savez(os.path.join(args.output, 'poi_map.npz'),
+             indices=indices,
+             num_points=num_points)
+    np.save(os.path.join(args.output, 'poi_statistic.npy'), statistic)
+
+    print("INFO: Kept {} of {} samples".format(len(indices), num_points))
@@ -0,0 +1,30 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+
+from attack_result import AttackResult
+from figures import write_table
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Table of the best key guesses of one or more runs")
+    parser.add_argument('results',
+                        nargs='*',
+                        default=['./results/attack_result.npz'],
+                        help="attack_result.npz files to compare")
+    parser.add_argument('--rows',
+                        type=int,
+                        default=10,
+                        help="best guesses per subkey (256 for all)")
+    parser.add_argument('--output',
+                        default='./figures/tableview.csv',
+                        help=".csv (one line per run, subkey and rank) or "
+                        ".html file")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    write_table([AttackResult.load(path) for path in args.results],
+                args.output,
+                args.rows,
+                run_names=args.results)
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+import cProfile
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Timings:
+    """Wall time, calls and throughput per pipeline stage.
+
+    Example:
+        timings = Timings('analyze')
+        with timings.stage('attack', traces=2500, nbytes=trace_array.nbytes):
+            ...
+        timings.save('timing_analyze.json')
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, traces=0, nbytes=0):
+        """Time a stage; `traces` and `nbytes` give the throughput."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, traces, nbytes)
+
+    def add(self, name, seconds, traces=0, nbytes=0):
+        with self._lock:
+            stage = self.stages.setdefault(name, {
+                'seconds': 0.0,
+                'calls': 0,
+                'traces': 0,
+                'bytes': 0,
+            })
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+            stage['traces'] += traces
+            stage['bytes'] += nbytes
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        stages = {}
+        for name, stage in self.stages.items():
+            stage = dict(stage)
+            if stage['traces'] and stage['seconds'] > 0:
+                stage['traces_per_second'] = stage['traces'] / stage['seconds']
+            if stage['bytes'] and stage['seconds'] > 0:
+                stage['mb_per_second'] = stage['bytes'] / 1e6 / stage['seconds']
+            stages[name] = stage
+        return {
+            'name': self.name,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                     time.localtime(self.start)),
+            'total_seconds': time.time() - self.start,
+            'stages': stages,
+            'counters': self.counters,
+        }
+
+    def save(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def print(self):
+        for name, stage in self.report()['stages'].items():
+            print("TIMING: {:<16} {:8.3f} s {:>10}".format(
+                name, stage['seconds'],
+                '{:.1f} traces/s'.format(stage['traces_per_second'])
+                if 'traces_per_second' in stage else ''))
+
+
+@contextmanager
+def profiled(path=None):
+    """Dump a cProfile of the block to `path` (no profiling if None)."""
+    if not path:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
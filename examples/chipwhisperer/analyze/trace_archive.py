@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import lzma
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from trace_io import chunks, load_captures, read_chunk
+
+magic = b'CWTA\x01'
+archive_name = 'traces.cwta'
+
+compressors = {
+    'none': (lambda data: data, lambda data: data),
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+
+def _shuffle(data, itemsize):
+    """Group the bytes by significance, which compresses much better."""
+    return np.frombuffer(data, np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def _unshuffle(data, itemsize):
+    return np.frombuffer(data, np.uint8).reshape(itemsize, -1).T.tobytes()
+
+
+def quantize(traces, dtype):
+    """Convert a chunk of traces to the stored type.
+
+    int16 uses a scale and offset per chunk, so the full range of the chunk
+    is spread over the 16 bits.
+
+    Returns:
+        The stored traces, scale and offset.
+    """
+    if np.dtype(dtype) != np.int16:
+        return traces.astype(dtype), 1.0, 0.0
+
+    low, high = float(np.min(traces)), float(np.max(traces))
+    offset = (high + low) / 2
+    scale = (high - low) / 65534 or 1.0
+    return np.round((traces - offset) / scale).astype(np.int16), scale, offset
+
+
+def write_archive(path, trace_array, textin_array, known_keys,
+                  dtype='int16', compression='zlib', chunk_size=256):
+    """Write captures into a chunked, compressed trace archive.
+
+    Layout: magic, the compressed chunks, the plaintexts and keys, a JSON
+    index with the position, scale and offset of every chunk and finally
+    the position of the index (8 bytes), so any range of traces can be
+    read by decompressing only the chunks it overlaps.
+    """
+    compress = compressors[compression][0]
+    itemsize = np.dtype(dtype).itemsize
+    num_traces, num_points = np.shape(trace_array)
+    index = {
+        'num_traces': num_traces,
+        'num_points': num_points,
+        'dtype': np.dtype(dtype).str,
+        'compression': compression,
+        'chunk_size': chunk_size,
+        'chunks': [],
+    }
+
+    with open(path, 'wb') as file:
+        file.write(magic)
+        for traces in chunks(num_traces, chunk_size):
+            stored, scale, offset = quantize(read_chunk(trace_array, traces),
+                                             dtype)
+            data = compress(_shuffle(stored.tobytes(), itemsize))
+            index['chunks'].append([file.tell(), len(data), scale, offset])
+            file.write(data)
+
+        for name, array in (('textin_array', textin_array),
+                            ('known_keys', known_keys)):
+            array = np.asarray(array, dtype=np.uint8)
+            data = compress(array.tobytes())
+            index[name] = [file.tell(), len(data), list(np.shape(array))]
+            file.write(data)
+
+        index_position = file.tell()
+        file.write(json.dumps(index).encode())
+        file.write(struct.pack('<Q', index_position))
+
+
+class TraceArchive:
+    """Random access reader for a trace archive.
+
+    Indexing with trace slices or index arrays (and optionally samples)
+    like a numpy array only decompresses the chunks that are needed, so the
+    archive can be used in place of the memory mapped `trace_array`.
+    """
+
+    def __init__(self, path, dtype=np.float64):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        with open(path, 'rb') as file:
+            if file.read(len(magic)) != magic:
+                raise ValueError(path + " is not a trace archive")
+            file.seek(-8, os.SEEK_END)
+            end = file.tell()
+            index_position, = struct.unpack('<Q', file.read(8))
+            file.seek(index_position)
+            self.index = json.loads(file.read(end - index_position))
+
+        self.shape = (self.index['num_traces'], self.index['num_points'])
+        self.stored_dtype = np.dtype(self.index['dtype'])
+        self.decompress = compressors[self.index['compression']][1]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _read_blob(self, position, length):
+        with open(self.path, 'rb') as file:
+            file.seek(position)
+            return self.decompress(file.read(length))
+
+    def _load(self, name):
+        position, length, shape = self.index[name]
+        return np.frombuffer(self._read_blob(position, length),
+                             dtype=np.uint8).reshape(shape)
+
+    @property
+    def textin_array(self):
+        return self._load('textin_array')
+
+    @property
+    def known_keys(self):
+        return self._load('known_keys')
+
+    def read_chunk(self, number):
+        """Decompress one chunk of traces."""
+        position, length, scale, offset = self.index['chunks'][number]
+        data = _unshuffle(self._read_blob(position, length),
+                          self.stored_dtype.itemsize)
+        stored = np.frombuffer(data, dtype=self.stored_dtype)
+        traces = stored.reshape(-1, self.shape[1]).astype(self.dtype)
+        if self.stored_dtype == np.int16:
+            traces = traces * scale + offset
+        return traces
+
+    def read(self, start, stop):
+        """Traces [start, stop) from only the chunks they overlap."""
+        chunk_size = self.index['chunk_size']
+        start, stop = max(start, 0), min(stop, self.shape[0])
+        if start >= stop:
+            return np.empty((0, self.shape[1]), dtype=self.dtype)
+        first, last = start // chunk_size, (stop - 1) // chunk_size
+        traces = np.concatenate(
+            [self.read_chunk(number) for number in range(first, last + 1)])
+        return traces[start - first * chunk_size:stop - first * chunk_size]
+
+    def take(self, rows):
+        """Traces of the indices `rows`, in their order, from only the
+        chunks that contain them."""
+        rows = np.asarray(rows, dtype=np.intp)
+        chunk_size = self.index['chunk_size']
+        traces = np.empty((len(rows), self.shape[1]), dtype=self.dtype)
+        numbers = rows // chunk_size
+        for number in np.unique(numbers):
+            selected = numbers == number
+            traces[selected] = self.read_chunk(number)[rows[selected] -
+                                                       number * chunk_size]
+        return traces
+
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        if isinstance(rows, slice) and rows.step in (None, 1):
+            start, stop, _ = rows.indices(self.shape[0])
+            return self.read(start, stop)[:, columns]
+        if not isinstance(rows, slice) and np.ndim(rows) == 0:
+            rows = int(rows) % self.shape[0]
+            return self.read(rows, rows + 1)[0, columns]
+        # index arrays, boolean masks and strided slices
+        return self.take(np.arange(self.shape[0])[rows])[:, columns]
+
+    def __array__(self, dtype=None, copy=None):
+        traces = self.read(0, self.shape[0])
+        return traces if dtype is None else traces.astype(dtype)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert captures to and from a compressed trace archive")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pack = subparsers.add_parser('pack', help=".npy captures to archive")
+    pack.add_argument('--captures', default='./captures/')
+    pack.add_argument('--output', default=archive_name)
+    pack.add_argument('--dtype',
+                      choices=['int16', 'float16', 'float32', 'float64'],
+                      default='int16',
+                      help="stored sample type (int16 is quantized per chunk)")
+    pack.add_argument('--compression',
+                      choices=sorted(compressors),
+                      default='zlib')
+    pack.add_argument('--chunk-size',
+                      type=int,
+                      default=256,
+                      help="number of traces per compressed chunk")
+
+    unpack = subparsers.add_parser('unpack', help="archive to .npy captures")
+    unpack.add_argument('--archive', default=archive_name)
+    unpack.add_argument('--output', default='./captures/')
+
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        trace_array, textin_array, known_keys = load_captures(args.captures)
+        write_archive(args.output, trace_array, textin_array, known_keys,
+                      args.dtype, args.compression, args.chunk_size)
+        size = sum(
+            os.path.getsize(os.path.join(args.captures, name + '.npy'))
+            for name in ('trace_array', 'textin_array', 'known_keys'))
+        print("INFO: Packed {} traces, {:.1f} MB -> {:.1f} MB".format(
+            len(trace_array), size / 1e6,
+            os.path.getsize(args.output) / 1e6))
+    else:
+        archive = TraceArchive(args.archive)
+        os.makedirs(args.output, exist_ok=True)
+        trace_array = np.lib.format.open_memmap(
+            os.path.join(args.output, 'trace_array.npy'),
+            mode='w+',
+            dtype=archive.dtype,
+            shape=archive.shape)
+        for number, traces in enumerate(
+                chunks(archive.shape[0], archive.index['chunk_size'])):
+            trace_array[traces] = archive.read_chunk(number)
+        trace_array.flush()
+        np.save(os.path.join(args.output, 'textin_array.npy'),
+                archive.textin_array)
+        np.save(os.path.join(args.output, 'known_keys.npy'),
+                archive.known_keys)
+        print("INFO: Unpacked {} traces".format(archive.shape[0]))
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+import os
+
+import numpy as np
+
+
+def load_captures(directory='./captures', mmap_mode='r'):
+    """Open the captured `.npy` arrays of a directory.
+
+    The arrays are memory mapped by default, so opening them takes constant
+    time and only the parts that are accessed are read from disk. A
+    directory with only a trace archive (see trace_archive.py) is read
+    from the archive instead.
+
+    Returns:
+        trace_array, textin_array and known_keys.
+    """
+    if not os.path.exists(os.path.join(directory, 'trace_array.npy')):
+        from trace_archive import TraceArchive, archive_name
+
+        archive_path = os.path.join(directory, archive_name)
+        if os.path.exists(archive_path):
+            archive = TraceArchive(archive_path)
+            return archive, archive.textin_array, archive.known_keys
+
+    return tuple(
+        np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+        for name in ('trace_array', 'textin_array', 'known_keys'))
+
+
+def chunks(length, size=None):
+    """Slices covering `range(length)` in pieces of at most `size`.
+
+    Used for both trace-count chunks and sample windows. Without a size a
+    single slice covering everything is returned.
+    """
+    if not size:
+        return [slice(0, length)]
+    return [slice(start, min(start + size, length))
+            for start in range(0, length, size)]
+
+
+def read_chunk(trace_array, traces, samples=slice(None), dtype=np.float64):
+    """Read a block of traces [trace, sample] into memory."""
+    return np.asarray(trace_array[traces, samples], dtype=dtype)
+
+
+def load_poi_map(directory='./captures'):
+    """Sample positions of a reduced capture (see select_poi.py).
+
+    Returns:
+        indices of the kept samples in the original traces and the original
+        number of samples, or None if the capture is not reduced.
+    """
+    path = os.path.join(directory, 'poi_map.npz')
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as poi_map:
+        return poi_map['indices'], int(poi_map['num_points'])
+
+
+def expand_samples(curves, poi_map, fill=0):
+    """Place curves [..., kept sample] back at their original positions."""
+    indices, num_points = poi_map
+    expanded = np.full(np.shape(curves)[:-1] + (num_points,), fill,
+                       dtype=np.result_type(curves))
+    expanded[..., indices] = curves
+    return expanded
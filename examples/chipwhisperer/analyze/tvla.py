@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from trace_io import chunks, load_captures, read_chunk
+
+# TVLA threshold of the t-statistic
+threshold = 4.5
+
+# share of the traces the fixed plaintext needs to be a real group rather
+# than a chance repetition among random plaintexts
+min_fixed_share = 0.1
+
+
+class Moments:
+    """Running mean and central moments (up to the 4th) per sample.
+
+    Chunks are combined with the pairwise update formulas of Welford, Chan
+    and Pébay, so the traces are only read once and never all at once.
+    """
+
+    def __init__(self, num_points):
+        self.n = 0
+        self.mean = np.zeros(num_points)
+        self.m2 = np.zeros(num_points)
+        self.m3 = np.zeros(num_points)
+        self.m4 = np.zeros(num_points)
+
+    def update(self, traces):
+        """Add a chunk of traces [trace, sample]."""
+        traces = np.asarray(traces, dtype=np.float64)
+        if len(traces) == 0:
+            return self
+
+        chunk = Moments(0)
+        chunk.n = len(traces)
+        chunk.mean = np.mean(traces, axis=0)
+        centered = traces - chunk.mean
+        squared = centered * centered
+        chunk.m2 = np.sum(squared, axis=0)
+        chunk.m3 = np.sum(squared * centered, axis=0)
+        chunk.m4 = np.sum(squared * squared, axis=0)
+        return self.merge(chunk)
+
+    def merge(self, other):
+        """Combine with the moments of another, disjoint set of traces."""
+        na, nb = self.n, other.n
+        n = na + nb
+        if nb == 0:
+            return self
+        if na == 0:
+            self.n, self.mean = other.n, other.mean.copy()
+            self.m2, self.m3, self.m4 = (other.m2.copy(), other.m3.copy(),
+                                         other.m4.copy())
+            return self
+
+        delta = other.mean - self.mean
+        delta2 = delta * delta
+
+        m4 = (self.m4 + other.m4 +
+              delta2 * delta2 * na * nb * (na * na - na * nb + nb * nb) /
+              n**3 + 6 * delta2 * (na * na * other.m2 + nb * nb * self.m2) /
+              n**2 + 4 * delta * (na * other.m3 - nb * self.m3) / n)
+        m3 = (self.m3 + other.m3 + delta2 * delta * na * nb * (na - nb) /
+              n**2 + 3 * delta * (na * other.m2 - nb * self.m2) / n)
+        m2 = self.m2 + other.m2 + delta2 * na * nb / n
+
+        self.n = n
+        self.mean = self.mean + delta * nb / n
+        self.m2, self.m3, self.m4 = m2, m3, m4
+        return self
+
+    def statistic(self, order=1):
+        """Mean and variance of the preprocessed traces of a t-test order.
+
+        The first order uses the raw traces, the second order the centered
+        squared traces (x - mean)^2.
+        """
+        if order == 1:
+            return self.mean, self.m2 / (self.n - 1)
+        if order == 2:
+            variance = self.m2 / self.n
+            return variance, self.m4 / self.n - variance * variance
+        raise ValueError("Only first and second order are supported")
+
+
+class TTest:
+    """Welch's t-test between the fixed and random group of traces."""
+
+    def __init__(self, num_points):
+        self.groups = (Moments(num_points), Moments(num_points))
+
+    def update(self, traces, fixed):
+        """Add a chunk of traces and whether each belongs to the fixed group."""
+        traces = np.asarray(traces, dtype=np.float64)
+        fixed = np.asarray(fixed, dtype=bool)
+        self.groups[0].update(traces[fixed])
+        self.groups[1].update(traces[~fixed])
+        return self
+
+    def merge(self, other):
+        for group, other_group in zip(self.groups, other.groups):
+            group.merge(other_group)
+        return self
+
+    def t_statistic(self, order=1):
+        """Per-sample t-statistic of the given order.
+
+        Samples where the statistic is undefined (no variance in either
+        group and equal means, e.g. a constant or clipped ADC sample) are
+        NaN. Different means without variance give an infinite t.
+        """
+        n0, n1 = (group.n for group in self.groups)
+        if min(n0, n1) < 2:
+            raise ValueError(
+                "Both groups need at least 2 traces (fixed: {}, random: {})"
+                .format(n0, n1))
+        (mean0, var0), (mean1, var1) = (group.statistic(order)
+                                        for group in self.groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (mean0 - mean1) / np.sqrt(var0 / n0 + var1 / n1)
+
+
+def fixed_group(textin_array):
+    """Mark the traces of the fixed plaintext (the most frequent one).
+
+    Raises:
+        ValueError: If no plaintext covers `min_fixed_share` of the traces,
+            e.g. for captures with random plaintexts only.
+    """
+    _, inverse, counts = np.unique(textin_array,
+                                   axis=0,
+                                   return_inverse=True,
+                                   return_counts=True)
+    fixed = np.argmax(counts)
+    if counts[fixed] < max(2, min_fixed_share * len(textin_array)):
+        raise ValueError(
+            "No fixed plaintext group: the most frequent plaintext occurs in "
+            "{} of {} traces, capture a fixed vs. random pattern or pass "
+            "--groups".format(counts[fixed], len(textin_array)))
+    return np.reshape(inverse, -1) == fixed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fixed vs. random TVLA t-test of the captured traces")
+    parser.add_argument('--captures',
+                        default='./captures/',
+                        help="directory with the captured .npy arrays")
+    parser.add_argument('--groups',
+                        help=".npy file marking the fixed traces (default: "
+                        "traces with the most frequent plaintext)")
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=1000,
+                        help="number of traces read at once")
+    parser.add_argument('--output', default='./results/tvla.json')
+    parser.add_argument('--fail-undefined',
+                        action='store_true',
+                        help="also fail on samples without variance in both "
+                        "groups, where the t-statistic is undefined")
+    args = parser.parse_args()
+
+    trace_array, textin_array, _ = load_captures(args.captures)
+    if args.groups:
+        fixed = np.load(args.groups).astype(bool)
+    else:
+        fixed = fixed_group(textin_array)
+
+    num_traces, num_points = np.shape(trace_array)
+    ttest = TTest(num_points)
+    for traces in chunks(num_traces, args.chunk_size):
+        ttest.update(read_chunk(trace_array, traces), fixed[traces])
+
+    report = {'threshold': threshold, 'passed': True}
+    for order in (1, 2):
+        t = ttest.t_statistic(order)
+        np.save('./results/tvla_t{}.npy'.format(order), t)
+
+        # undefined (0/0) samples are no evidence of leakage, they are only
+        # reported unless --fail-undefined, infinite ones are leaking
+        undefined = np.isnan(t)
+        with np.errstate(invalid='ignore'):
+            leaking = np.flatnonzero(abs(t) > threshold)
+        max_t = (float(np.max(abs(t[~undefined])))
+                 if not np.all(undefined) else float('nan'))
+        report['order_{}'.format(order)] = {
+            'max_t': max_t,
+            'leaking_samples': len(leaking),
+            'undefined_samples': int(np.sum(undefined)),
+        }
+        report['passed'] &= len(leaking) == 0 and not (
+            args.fail_undefined and np.any(undefined))
+        print("Order {}: max |t| = {:.2f}, {} samples above {} ({} "
+              "undefined)".format(order, max_t, len(leaking), threshold,
+                                  np.sum(undefined)))
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    if not report['passed']:
+        print("ERROR: Leakage detected")
+        sys.exit(1)
+    print("INFO: No leakage detected")
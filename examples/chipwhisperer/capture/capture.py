@@ -1,15 +1,50 @@
 #!/home/ubuntu/.pyenv/versions/cw/lib/python3.9
 
-import chipwhisperer as cw
+import os
+import sys
 import time
-from tqdm import tnrange, trange
 import numpy as np
 import subprocess
 
+# SIMULATE=1 generates synthetic traces instead of using a ChipWhisperer,
+# SIMULATE_LEAKAGE, SIMULATE_NOISE, SIMULATE_JITTER and SIMULATE_SEED set up
+# the simulated scope and plaintexts
+SIMULATE = os.environ.get('SIMULATE') == '1'
+if SIMULATE:
+    import simulation as cw
+    # independent streams for the noise and the plaintexts, both fixed by
+    # the seed
+    scope_seed, text_seed = np.random.SeedSequence(
+        int(os.environ['SIMULATE_SEED']) if 'SIMULATE_SEED' in os.environ
+        else None).spawn(2)
+    SCOPE_SETTINGS = {
+        'leakage': float(os.environ.get('SIMULATE_LEAKAGE', 1.0)),
+        'noise': float(os.environ.get('SIMULATE_NOISE', 1.0)),
+        'jitter': int(os.environ.get('SIMULATE_JITTER', 0)),
+        'seed': scope_seed,
+    }
+    KTP_SETTINGS = {'seed': text_seed}
+else:
+    import chipwhisperer as cw
+    SCOPE_SETTINGS = {}
+    KTP_SETTINGS = {}
+
+from capture_pipeline import CapturePipeline
+from trace_store import TraceStore
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                    'analyze'))
+from timing import Timings  # noqa: E402
+
 SCOPETYPE = 'OPENADC'
 PLATFORM = 'CWLITEARM'
 CRYPTO_TARGET='TINYAES128C'
 
+# Sample type of trace_array.npy: float64 as returned by the ChipWhisperer,
+# or int16 with the raw 10 bit ADC codes at a quarter of the size
+TRACE_DTYPE = np.float64
+
 
 ############################
 # Connect to ChipWhisperer #
@@ -19,18 +54,21 @@ try:
     if not scope.connectStatus:
         scope.con()
 except NameError:
-    scope = cw.scope()
+    scope = cw.scope(**SCOPE_SETTINGS)
    
 try:
     target = cw.target(scope)
 except IOError:
     print("INFO: Caught exception on reconnecting to target - attempting to reconnect to scope first.")
     print("INFO: This is a work-around when USB has died without Python knowing. Ignore errors above this line.")
-    scope = cw.scope()
+    scope = cw.scope(**SCOPE_SETTINGS)
     target = cw.target(scope)
 
 print("INFO: Found ChipWhisperer")
 
+# Time of each stage, written to timing_capture.json at the end
+timings = Timings('capture')
+
 
 ###########################
 # Target Programmer Setup #
@@ -69,7 +107,8 @@ def reset_target(scope):
 
 # subprocess.run(["make", "PLATFORM=CWLITEARM", "CRYPTO_TARGET=TINYAES128C"], cwd="../hardware/victims/firmware/simpleserial-aes")
 
-cw.program_target(scope, prog, "./image/simpleserial-aes-{}.hex".format(PLATFORM))
+with timings.stage('program'):
+    cw.program_target(scope, prog, "./image/simpleserial-aes-{}.hex".format(PLATFORM))
 
 
 ###################
@@ -102,9 +141,8 @@ cw.program_target(scope, prog, "./image/simpleserial-aes-{}.hex".format(PLATFORM
 # Capture Traces #
 ##################
 
-ktp = cw.ktp.Basic()
+ktp = cw.ktp.Basic(**KTP_SETTINGS)
 
-traces = []
 N = 250  # Number of traces
 
 if PLATFORM == "CWLITEARM" or PLATFORM == "CW308_STM32F3":
@@ -115,31 +153,46 @@ elif PLATFORM == "CWLITEXMEGA" or PLATFORM == "CW303":
     scope.adc.offset = 500 + 700 + 170
     N = 5000
     
+# The traces are written to trace_array.npy, textin_array.npy and
+# known_keys.npy while capturing and flushed every 100 traces.
+# An interrupted capture continues where the last flush left off.
+store = TraceStore('.', N, scope.adc.samples, dtype=TRACE_DTYPE)
+
+
+def to_adc_codes(wave):
+    # the ChipWhisperer scales the 10 bit ADC codes to [-0.5, 0.5)
+    return np.round((wave + 0.5) * 1024).astype(np.int16)
+
+
 print(scope)
-for i in trange(N, desc='Capturing traces'):
-    key, text = ktp.next()  # manual creation of a key, text pair can be substituted here
 
-    trace = cw.capture_trace(scope, target, text, key)
-    if trace is None:
-        continue
-    traces.append(trace)
-#    plot.send(trace)
+# One thread drives the scope and target while worker threads convert and
+# store the traces, the throughput is shown live in the progress bar.
+# ktp.next: manual creation of a key, text pair can be substituted here
+# for fixed key, the stored keys are all the same
+pipeline = CapturePipeline(
+    lambda text, key: cw.capture_trace(scope, target, text, key),
+    ktp.next,
+    store,
+    process=to_adc_codes if TRACE_DTYPE == np.int16 else None,
+    # process=lambda wave: plot.send(wave) or wave,
+    timings=timings,
+)
+with timings.stage('capture'):
+    pipeline.run()
 
 
 scope.dis()
 target.dis()
 
-##################################
-# Convert Traces to numpy arrays #
-# Save Captured Traces to Disk   #
-##################################
-
-trace_array = np.asarray([trace.wave for trace in traces])
-textin_array = np.asarray([trace.textin for trace in traces])
-known_keys = np.asarray([trace.key for trace in traces])  # for fixed key, these keys are all the same
+####################################
+# Trim the Captured Traces on Disk #
+####################################
 
-np.save('trace_array.npy', trace_array)
-np.save('textin_array.npy', textin_array)
-np.save('known_keys.npy', known_keys)
+with timings.stage('close'):
+    store.close()
 
 print("INFO: Saved Captured Traces")
+
+timings.print()
+timings.save('timing_capture.json')
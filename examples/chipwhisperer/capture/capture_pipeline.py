@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+
+import queue
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+from tqdm import tqdm
+
+
+class CapturePipeline:
+    """Producer/consumer capture loop.
+
+    One thread drives the scope and target and puts the raw traces into a
+    bounded queue. Worker threads convert (and optionally post-process,
+    e.g. compress) the traces and append them to the store, so persisting
+    a trace never delays the next acquisition for longer than the queue
+    is full. The traces are stored in the order they were captured.
+
+    Args:
+        capture_trace: Function (text, key) returning a trace with `wave`,
+            `textin` and `key`, or None if the capture failed, e.g.
+            `lambda text, key: cw.capture_trace(scope, target, text, key)`.
+        next_pair: Function returning the next (key, text), e.g.
+            `ktp.next`.
+        store: A `TraceStore` (anything with `count`, `append` and
+            `num_traces`).
+        process: Optional function applied to every wave by the workers.
+        queue_size: Maximum number of traces waiting for the workers.
+        workers: Number of worker threads.
+        dtype: Type the waves are converted to.
+        timings: Optional `Timings` (analyze/timing.py) recording the
+            'acquire', 'process' and 'store' stages per trace.
+    """
+
+    def __init__(self, capture_trace, next_pair, store, process=None,
+                 queue_size=64, workers=2, dtype=np.float64, timings=None):
+        self.capture_trace = capture_trace
+        self.next_pair = next_pair
+        self.store = store
+        self.process = process
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.workers = workers
+        self.dtype = dtype
+        self.timings = timings
+
+        self.captured = 0
+        self.failed = 0
+        self.errors = []
+        self._store_turn = threading.Condition()
+        self._stored = 0  # index of the next trace to append
+        self._stop = threading.Event()
+
+    def _stage(self, name, nbytes=0):
+        if self.timings is None:
+            return nullcontext()
+        return self.timings.stage(name, traces=1, nbytes=nbytes)
+
+    def _halt(self):
+        """Stop the producer and wake the workers waiting for their turn."""
+        self._stop.set()
+        with self._store_turn:
+            self._store_turn.notify_all()
+
+    def _produce(self, num_traces):
+        try:
+            for _ in range(num_traces):
+                if self._stop.is_set():
+                    break
+                key, text = self.next_pair()
+                with self._stage('acquire'):
+                    trace = self.capture_trace(text, key)
+                if trace is None:
+                    self.failed += 1
+                    if self.timings is not None:
+                        self.timings.count('failed_captures')
+                    continue
+                self.queue.put(
+                    (self.captured, trace.wave, trace.textin, trace.key))
+                self.captured += 1
+        except Exception as error:
+            self.errors.append(error)
+            self._halt()
+        finally:
+            for _ in range(self.workers):
+                self.queue.put(None)
+
+    def _consume(self, progress):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self._stop.is_set():
+                continue  # drain the queue so the producer cannot block
+
+            try:
+                index, wave, textin, key = item
+                with self._stage('process'):
+                    wave = np.asarray(wave, dtype=self.dtype)
+                    if self.process is not None:
+                        wave = self.process(wave)
+                with self._store_turn:
+                    # keep the capture order, whatever worker finishes first
+                    self._store_turn.wait_for(lambda: self._stored == index
+                                              or self._stop.is_set())
+                    if self._stop.is_set():
+                        continue
+                    with self._stage('store', wave.nbytes):
+                        self.store.append(wave, textin, key)
+                        progress.update()
+                    self._stored += 1
+                    self._store_turn.notify_all()
+            except Exception as error:
+                self.errors.append(error)
+                self._halt()
+
+    def run(self, num_traces=None):
+        """Capture until the store is full (or `num_traces` attempts).
+
+        Returns:
+            The captured traces per second.
+        """
+        if num_traces is None:
+            num_traces = self.store.num_traces - self.store.count
+
+        progress = tqdm(total=self.store.num_traces,
+                        initial=self.store.count,
+                        desc='Capturing traces')
+        threads = [threading.Thread(target=self._produce, args=(num_traces,))]
+        threads += [
+            threading.Thread(target=self._consume, args=(progress,))
+            for _ in range(self.workers)
+        ]
+
+        start = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            while threads[0].is_alive():
+                threads[0].join(timeout=1)
+                elapsed = time.perf_counter() - start
+                progress.set_postfix(
+                    captured='{:.1f} traces/s'.format(self.captured / elapsed),
+                    queued=self.queue.qsize())
+        except BaseException:
+            # e.g. Ctrl-C: stop the producer instead of capturing all traces
+            self._halt()
+            raise
+        finally:
+            for thread in threads:
+                if thread.is_alive():
+                    thread.join()
+            progress.close()
+
+        if self.errors:
+            raise self.errors[0]
+
+        rate = self.captured / (time.perf_counter() - start)
+        print("INFO: Captured {} traces ({} failed) at {:.1f} traces/s".format(
+            self.captured, self.failed, rate))
+        return rate
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+"""Simulated ChipWhisperer backend.
+
+Drop-in replacement for the parts of the `chipwhisperer` module used by
+capture.py (`import simulation as cw`). The traces are synthetic: the
+Hamming weight of the first round SBox output of every key byte leaks at
+its own sample, on top of a fixed waveform, Gaussian noise and an
+optional random shift (jitter) per trace.
+"""
+
+from collections import namedtuple
+from types import SimpleNamespace
+
+import numpy as np
+
+Trace = namedtuple('Trace', ['wave', 'textin', 'textout', 'key'])
+
+# default key of cw.ktp.Basic
+default_key = bytearray.fromhex('2b7e151628aed2a6abf7158809cf4f3c')
+
+
+def _aes_sbox():
+    """The AES SBox: inverse in GF(2^8) followed by the affine transform.
+
+    Computed here so the simulation does not depend on the attack code.
+    """
+    sbox = np.zeros(256, dtype=np.uint8)
+    p = q = 1
+    while True:
+        # p runs through all non-zero elements as powers of 3, q = 1 / p
+        p ^= (p << 1 ^ (0x1b if p & 0x80 else 0)) & 0xff
+        q ^= q << 1
+        q ^= q << 2
+        q ^= q << 4
+        q &= 0xff
+        if q & 0x80:
+            q ^= 0x09
+        affine = q
+        for shift in range(1, 5):
+            affine ^= (q << shift | q >> (8 - shift)) & 0xff
+        sbox[p] = affine ^ 0x63
+        if p == 1:
+            break
+    sbox[0] = 0x63
+    return sbox
+
+
+sbox_table = _aes_sbox()
+
+# number of set bits for every byte value
+hamming_weight = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis],
+                               axis=1).sum(axis=1).astype(np.uint8)
+
+
+def leak_points(num_points, num_bytes=16):
+    """Sample at which every key byte leaks."""
+    return (np.arange(num_bytes) + 1) * num_points // (num_bytes + 2)
+
+
+def simulate_traces(textin_array, key, num_points=5000, leakage=1.0,
+                    noise=1.0, jitter=0, rng=None):
+    """Synthetic traces [trace, sample] for plaintexts [trace, byte].
+
+    Args:
+        textin_array: Plaintexts [trace, byte].
+        key: AES key (16 bytes).
+        num_points: Samples per trace.
+        leakage: Amplitude of one bit of Hamming weight.
+        noise: Standard deviation of the Gaussian noise.
+        jitter: Maximum random shift of a trace in samples.
+        rng: numpy random Generator.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    textin_array = np.asarray(textin_array, dtype=np.uint8)
+    key = np.frombuffer(bytes(key), dtype=np.uint8)
+    num_traces = len(textin_array)
+
+    # fixed "program" waveform every trace has in common
+    samples = np.arange(num_points)
+    waves = np.tile(np.sin(samples / 7.0) + 0.5 * np.sin(samples / 31.0),
+                    (num_traces, 1))
+    waves += rng.normal(0, noise, (num_traces, num_points))
+
+    points = leak_points(num_points, len(key))
+    waves[:, points] += leakage * hamming_weight[sbox_table[textin_array ^
+                                                            key]]
+
+    if jitter:
+        shifts = rng.integers(-jitter, jitter + 1, size=(num_traces, 1))
+        waves = np.take_along_axis(waves, (samples - shifts) % num_points,
+                                   axis=1)
+    return waves
+
+
+class _Basic:
+    """Fixed key, random plaintext (like cw.ktp.Basic)."""
+
+    def __init__(self, key=default_key, seed=None):
+        self.key = bytearray(key)
+        self.rng = np.random.default_rng(seed)
+
+    def next(self):
+        text = bytearray(self.rng.integers(0, 256, 16, dtype=np.uint8))
+        return self.key, text
+
+
+ktp = SimpleNamespace(Basic=_Basic)
+programmers = SimpleNamespace(STM32FProgrammer=None, XMEGAProgrammer=None)
+
+
+class SimulatedScope:
+    """Scope with the settings capture.py uses and the leakage settings."""
+
+    def __init__(self, leakage=1.0, noise=1.0, jitter=0, seed=None):
+        self.adc = SimpleNamespace(samples=5000, offset=0)
+        self.gain = SimpleNamespace(db=25)
+        self.io = SimpleNamespace(nrst='high', pdic='high_z')
+        self.leakage = leakage
+        self.noise = noise
+        self.jitter = jitter
+        self.rng = np.random.default_rng(seed)
+        self.connectStatus = True
+
+    def default_setup(self):
+        pass
+
+    def con(self):
+        self.connectStatus = True
+
+    def dis(self):
+        self.connectStatus = False
+
+    def __repr__(self):
+        return ("SimulatedScope(samples={}, leakage={}, noise={}, "
+                "jitter={})".format(self.adc.samples, self.leakage,
+                                    self.noise, self.jitter))
+
+
+class SimulatedTarget:
+
+    def __init__(self, scope):
+        self.scope = scope
+
+    def dis(self):
+        pass
+
+
+def scope(**settings):
+    return SimulatedScope(**settings)
+
+
+def target(scope):
+    return SimulatedTarget(scope)
+
+
+def program_target(scope, prog, fw_path):
+    print("INFO: Simulation, not programming " + fw_path)
+
+
+def capture_trace(scope, target, plaintext, key):
+    """Capture one synthetic trace (like cw.capture_trace)."""
+    wave = simulate_traces([plaintext], key, scope.adc.samples,
+                           scope.leakage, scope.noise, scope.jitter,
+                           scope.rng)[0]
+    return Trace(wave, plaintext, None, key)
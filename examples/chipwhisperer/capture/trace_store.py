@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+
+import json
+import os
+
+import numpy as np
+
+
+class TraceStore:
+    """Append-only on-disk store for captured traces.
+
+    The three arrays are preallocated as memory mapped `.npy` files
+    (`trace_array.npy`, `textin_array.npy` and `known_keys.npy`), every
+    trace is written straight to disk and the number of stored traces is
+    persisted every `flush_every` traces. An interrupted capture can be
+    resumed from the last flush. `close` trims the files to the captured
+    traces, so the result is the same as saving the arrays with `np.save`.
+    """
+
+    progress_file = 'capture_progress.json'
+
+    def __init__(self, directory, num_traces, num_points, text_len=16,
+                 key_len=16, dtype=np.float64, flush_every=100, resume=True):
+        self.directory = directory
+        self.flush_every = flush_every
+        shapes = {
+            'trace_array': ((num_traces, num_points), dtype),
+            'textin_array': ((num_traces, text_len), np.uint8),
+            'known_keys': ((num_traces, key_len), np.uint8),
+        }
+
+        progress = self._read_progress()
+        if resume and progress is not None and \
+                progress['num_traces'] == num_traces and \
+                progress['num_points'] == num_points:
+            mode = 'r+'
+            self.count = progress['count']
+            print("INFO: Resuming capture after {} traces".format(self.count))
+        else:
+            mode = 'w+'
+            self.count = 0
+
+        self.arrays = {
+            name: np.lib.format.open_memmap(self._path(name),
+                                            mode=mode,
+                                            dtype=dtype,
+                                            shape=shape)
+            for name, (shape, dtype) in shapes.items()
+        }
+        self.num_traces = num_traces
+        self.num_points = num_points
+        self._write_progress()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + '.npy')
+
+    def _read_progress(self):
+        try:
+            with open(os.path.join(self.directory, self.progress_file)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_progress(self):
+        path = os.path.join(self.directory, self.progress_file)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(
+                {
+                    'count': self.count,
+                    'num_traces': self.num_traces,
+                    'num_points': self.num_points,
+                }, file)
+        os.replace(path + '.tmp', path)
+
+    @property
+    def full(self):
+        return self.count >= self.num_traces
+
+    def append(self, wave, textin, key):
+        """Write one trace with its plaintext and key."""
+        if self.full:
+            raise IndexError("Trace store is full")
+
+        self.arrays['trace_array'][self.count] = wave
+        self.arrays['textin_array'][self.count] = np.frombuffer(
+            bytes(textin), dtype=np.uint8)
+        self.arrays['known_keys'][self.count] = np.frombuffer(bytes(key),
+                                                              dtype=np.uint8)
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        """Write the traces to disk, then record how many are stored."""
+        for array in self.arrays.values():
+            array.flush()
+        self._write_progress()
+
+    def close(self):
+        """Flush and trim the arrays to the number of captured traces."""
+        self.flush()
+        for name in list(self.arrays):
+            array = self.arrays.pop(name)
+            if self.count < self.num_traces:
+                # the slice is streamed from the memory map to the new file
+                temp_path = self._path(name) + '.tmp.npy'
+                np.save(temp_path, array[:self.count])
+                del array
+                os.replace(temp_path, self._path(name))
+        os.remove(os.path.join(self.directory, self.progress_file))